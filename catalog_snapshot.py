@@ -0,0 +1,283 @@
+"""Columnar (Arrow/Feather) snapshot of the catalog XLSX sheets.
+
+The app reads sheets through read_excel_sheet() / read_excel_sheets(), which serve
+a sheet from the snapshot when its source workbook hash still matches the manifest
+and fall back to parsing the XLSX (refreshing the snapshot) when it does not.
+read_excel_sheets() opens the workbook once for several sheets and can keep only
+the first column plus a set of wanted columns (e.g. the price matrix currencies).
+Columns mixing numbers and text are stored as text plus a per-cell type tag, so
+every cell reads back with its original value and type.
+
+Rebuild the snapshot ahead of a deploy with:
+    python catalog_snapshot.py
+"""
+import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.path.join(BASE_DIR, ".catalog-snapshot")
+MANIFEST_FILE_NAME = "manifest.json"
+SNAPSHOT_FORMAT_VERSION = 2
+# Mixed columns: "<column><CELL_TYPE_SUFFIX>" holds each cell's CELL_TYPES index; the schema metadata lists the columns
+CELL_TYPE_SUFFIX = "\x1fcell_type"
+CELL_TYPES = ("null", "str", "int", "float", "bool", "datetime", "date", "time")
+MIXED_COLUMNS_METADATA_KEY = b"mixed_columns"
+
+# Sheets compiled by the build step: (workbook file name, sheet name)
+SNAPSHOT_SOURCES = [
+    ("raw-data.xlsx", "APP"),
+    ("price-matrix_EUROPE.xlsx", "Price matrix wholesale"),
+    ("price-matrix_EUROPE.xlsx", "Price matrix retail"),
+    ("price-matrix_GBP-IE.xlsx", "Price matrix wholesale"),
+    ("price-matrix_GBP-IE.xlsx", "Price matrix retail"),
+]
+
+_sha256_memo = {}
+
+
+def file_sha256(path):
+    stat_result = os.stat(path)
+    memo_key = (path, stat_result.st_mtime_ns, stat_result.st_size)
+    if memo_key not in _sha256_memo:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _sha256_memo[memo_key] = digest.hexdigest()
+    return _sha256_memo[memo_key]
+
+
+def snapshot_entry_name(path, sheet_name):
+    workbook = os.path.splitext(os.path.basename(path))[0]
+    return f"{workbook}__{sheet_name}".replace(" ", "_").replace("/", "_")
+
+
+def read_manifest(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": SNAPSHOT_FORMAT_VERSION, "entries": {}}
+    if manifest.get("version") != SNAPSHOT_FORMAT_VERSION:
+        return {"version": SNAPSHOT_FORMAT_VERSION, "entries": {}}
+    return manifest
+
+
+def _write_manifest(manifest, snapshot_dir):
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE_NAME)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def to_arrow_table(df):
+    # Flat Arrow table for file exports. Arrow needs one type per column, so columns mixing
+    # numbers and text (e.g. codes) are stored as text; snapshots use to_snapshot_table instead.
+    df = df.copy()
+    df.columns = [str(col) for col in df.columns]
+    for col in df.columns:
+        if df[col].dtype == object:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                df[col] = df[col].map(lambda v: str(v) if pd.notna(v) else None)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _encode_cell(value):
+    # (CELL_TYPES index, text) for one cell of a mixed column
+    if isinstance(value, (bool, np.bool_)):
+        return CELL_TYPES.index("bool"), str(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return CELL_TYPES.index("int"), str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return (CELL_TYPES.index("null"), None) if np.isnan(value) else (CELL_TYPES.index("float"), repr(float(value)))
+    if value is None or value is pd.NaT:
+        return CELL_TYPES.index("null"), None
+    if isinstance(value, datetime.datetime):
+        return CELL_TYPES.index("datetime"), pd.Timestamp(value).isoformat()
+    if isinstance(value, datetime.date):
+        return CELL_TYPES.index("date"), value.isoformat()
+    if isinstance(value, datetime.time):
+        return CELL_TYPES.index("time"), value.isoformat()
+    return CELL_TYPES.index("str"), str(value)
+
+
+_CELL_DECODERS = {
+    "null": lambda text: np.nan,
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": lambda text: text == "True",
+    "datetime": pd.Timestamp,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+}
+
+
+def to_snapshot_table(df):
+    """Arrow table for a snapshot entry. Unlike to_arrow_table, no cell value is lost:
+    a column mixing numbers and text is stored as text plus a type tag column."""
+    df = df.copy()
+    df.columns = [str(col) for col in df.columns]
+    mixed_columns = []
+    for col in list(df.columns):
+        if df[col].dtype == object:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                cell_types, texts = zip(*map(_encode_cell, df[col])) if len(df) else ((), ())
+                df[col] = pd.Series(texts, index=df.index, dtype=object)
+                df[f"{col}{CELL_TYPE_SUFFIX}"] = np.array(cell_types, dtype=np.int8)
+                mixed_columns.append(col)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), MIXED_COLUMNS_METADATA_KEY: json.dumps(mixed_columns).encode("utf-8")})
+
+
+def from_snapshot_table(table):
+    """DataFrame from a to_snapshot_table table (or a column selection of one), mixed columns recombined."""
+    mixed_columns = json.loads((table.schema.metadata or {}).get(MIXED_COLUMNS_METADATA_KEY, b"[]"))
+    df = table.to_pandas()
+    cell_type_cols = []
+    for col in mixed_columns:
+        cell_type_col = f"{col}{CELL_TYPE_SUFFIX}"
+        if col not in df.columns or cell_type_col not in df.columns:
+            continue
+        df[col] = pd.Series([_CELL_DECODERS[CELL_TYPES[cell_type]](text) for cell_type, text in zip(df[cell_type_col], df[col].astype(object))],
+                            index=df.index, dtype=object)
+        cell_type_cols.append(cell_type_col)
+    return df.drop(columns=cell_type_cols)
+
+
+def normalize_sheet_frame(df):
+    # The frame exactly as a snapshot entry serves it, so a cold (XLSX) and a warm
+    # (snapshot) load give the same columns and dtypes.
+    return from_snapshot_table(to_snapshot_table(df))
+
+
+def write_snapshot_entry(path, sheet_name, df, snapshot_dir=SNAPSHOT_DIR, wanted_columns=None):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    entry_name = snapshot_entry_name(path, sheet_name)
+    data_file = f"{entry_name}.arrow"
+    data_path = os.path.join(snapshot_dir, data_file)
+    tmp_path = f"{data_path}.{os.getpid()}.tmp"
+    # Uncompressed so the file can be memory-mapped on load.
+    feather.write_feather(to_snapshot_table(df), tmp_path, compression="uncompressed")
+    os.replace(tmp_path, data_path)
+
+    manifest = read_manifest(snapshot_dir)
+    manifest["entries"][entry_name] = {
+        "source": os.path.basename(path),
+        "sheet": sheet_name,
+        "sha256": file_sha256(path),
+        "file": data_file,
+        "rows": len(df),
+        # None for a full sheet; otherwise the column selection the entry was written for
+        "wanted_columns": sorted(wanted_columns) if wanted_columns is not None else None,
+    }
+    _write_manifest(manifest, snapshot_dir)
+
+
+def select_sheet_columns(header, wanted_columns):
+    """Positions of the first column plus every later column named in wanted_columns."""
+    return [0] + [pos for pos, col in enumerate(header) if pos > 0 and col in wanted_columns] if len(header) else []
+
+
+def read_snapshot_entry(path, sheet_name, snapshot_dir=SNAPSHOT_DIR, wanted_columns=None):
+    """Returns the snapshot DataFrame for a sheet, or None if missing or stale.
+
+    With wanted_columns, a full-sheet entry is narrowed on read (only those columns
+    are converted from the memory map); a narrowed entry must match the selection.
+    """
+    entry = read_manifest(snapshot_dir)["entries"].get(snapshot_entry_name(path, sheet_name))
+    if not entry or entry.get("sha256") != file_sha256(path):
+        return None
+    entry_wanted = entry.get("wanted_columns")
+    if entry_wanted is not None and (wanted_columns is None or entry_wanted != sorted(wanted_columns)):
+        return None
+    try:
+        table = feather.read_table(os.path.join(snapshot_dir, entry["file"]), memory_map=True)
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if wanted_columns is not None and entry_wanted is None:
+        names = table.schema.names
+        positions = select_sheet_columns(names, wanted_columns)
+        positions += [names.index(f"{names[pos]}{CELL_TYPE_SUFFIX}") for pos in positions if f"{names[pos]}{CELL_TYPE_SUFFIX}" in names]
+        table = table.select(positions)
+    return from_snapshot_table(table)
+
+
+def read_excel_sheet(path, sheet_name, snapshot_dir=SNAPSHOT_DIR):
+    """Drop-in for pd.read_excel(path, sheet_name=...) backed by the snapshot.
+
+    Sheets parsed from the XLSX are normalized like snapshot entries, so both
+    paths serve the same frame.
+    """
+    df = read_snapshot_entry(path, sheet_name, snapshot_dir)
+    if df is not None:
+        return df
+    df = normalize_sheet_frame(pd.read_excel(path, sheet_name=sheet_name))
+    try:
+        write_snapshot_entry(path, sheet_name, df, snapshot_dir)
+    except OSError:
+        pass  # Read-only deploy: keep serving from XLSX.
+    return df
+
+
+def read_excel_sheets(path, sheet_names, wanted_columns=None, snapshot_dir=SNAPSHOT_DIR):
+    """Reads several sheets of one workbook: {sheet name: DataFrame}.
+
+    Fresh sheets come from the snapshot; the rest are parsed from a single open of
+    the workbook. With wanted_columns only the first column plus those columns are
+    kept (usecols), so unused columns are never converted into the frames.
+    """
+    frames, stale_sheets = {}, []
+    for sheet_name in sheet_names:
+        df = read_snapshot_entry(path, sheet_name, snapshot_dir, wanted_columns)
+        if df is None:
+            stale_sheets.append(sheet_name)
+        else:
+            frames[sheet_name] = df
+    if stale_sheets:
+        with pd.ExcelFile(path) as workbook:
+            for sheet_name in stale_sheets:
+                usecols = None
+                if wanted_columns is not None:
+                    usecols = select_sheet_columns(workbook.parse(sheet_name, nrows=0).columns, wanted_columns)
+                df = normalize_sheet_frame(workbook.parse(sheet_name, usecols=usecols))
+                try:
+                    write_snapshot_entry(path, sheet_name, df, snapshot_dir, wanted_columns)
+                except OSError:
+                    pass  # Read-only deploy: keep serving from XLSX.
+                frames[sheet_name] = df
+    return {sheet_name: frames[sheet_name] for sheet_name in sheet_names}
+
+
+def build_snapshot(base_dir=BASE_DIR, snapshot_dir=SNAPSHOT_DIR):
+    built = []
+    for file_name, sheet_name in SNAPSHOT_SOURCES:
+        path = os.path.join(base_dir, file_name)
+        if not os.path.exists(path):
+            print(f"Skipping missing source: {path}")
+            continue
+        # Full sheets, so the entries serve any column selection
+        if read_snapshot_entry(path, sheet_name, snapshot_dir) is not None:
+            print(f"Up to date: {file_name} [{sheet_name}]")
+            continue
+        df = pd.read_excel(path, sheet_name=sheet_name)
+        write_snapshot_entry(path, sheet_name, df, snapshot_dir)
+        print(f"Built: {file_name} [{sheet_name}] ({len(df)} rows)")
+        built.append((file_name, sheet_name))
+    return built
+
+
+if __name__ == "__main__":
+    build_snapshot()
@@ -0,0 +1,653 @@
+"""Catalog loading and master data export, shared by the Streamlit app and the batch CLI.
+
+Nothing here imports Streamlit, so the module can be used headless:
+    python master_data.py --spec selection.json --all-currencies --output-dir out/ [--format csv] [--workers 4] [--single-workbook]
+
+The selection spec is a JSON list; each entry matches combinations like the app's
+bulk selection (all keys optional) and may name the base colors to use:
+    [{"family": "Outline Sofa", "upholstery_type": "Fiord", "upholstery_color": "171",
+      "filter": "`Product Type` == 'Sofa'", "base_colors": ["Black"]}]
+"base_colors" may also be "all"; items needing a base color without one are skipped.
+"""
+import argparse
+import ast
+import io
+import json
+import multiprocessing
+import operator
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from catalog_snapshot import read_excel_sheet, read_excel_sheets, to_arrow_table
+
+# --- Configuration & Constants ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DATA_XLSX_PATH = os.path.join(BASE_DIR, "raw-data.xlsx")
+PRICE_MATRIX_EUROPE_XLSX_PATH = os.path.join(BASE_DIR, "price-matrix_EUROPE.xlsx")
+PRICE_MATRIX_GBP_IE_XLSX_PATH = os.path.join(BASE_DIR, "price-matrix_GBP-IE.xlsx") 
+MASTERDATA_TEMPLATE_XLSX_PATH = os.path.join(BASE_DIR, "Masterdata-output-template.xlsx")
+
+RAW_DATA_APP_SHEET = "APP"
+RAW_DATA_REQUIRED_COLS = ['Product Type', 'Product Model', 'Sofa Direction', 'Base Color', 'Product Family', 'Item No', 'Article No', 'Image URL swatch', 'Upholstery Type', 'Upholstery Color', 'Market', 'Item Name']
+RAW_DATA_DERIVED_COLS = ['Product Display Name', 'Base Color Cleaned']
+RAW_DATA_KEY_COLS = ['Item No', 'Article No']
+PRICE_MATRIX_WHOLESALE_SHEET = "Price matrix wholesale"
+PRICE_MATRIX_RETAIL_SHEET = "Price matrix retail"
+
+
+EXPECTED_EUROPE_CURRENCIES = ['DACH - EURO', 'DKK', 'EURO', 'NOK', 'PLN', 'SEK', 'AUD']
+EXPECTED_GBP_IE_CURRENCIES = ['GBP', 'IE - EUR']
+
+# Market rules: each currency group hides the rows of one market
+MARKET_RULE_EUROPE = "EUROPE"
+MARKET_RULE_GBP_IE = "GBP_IE"
+EXCLUDED_MARKET_BY_RULE = {MARKET_RULE_EUROPE: 'UK', MARKET_RULE_GBP_IE: 'EU'}
+
+CURRENCIES_BY_RULE = {MARKET_RULE_EUROPE: EXPECTED_EUROPE_CURRENCIES, MARKET_RULE_GBP_IE: EXPECTED_GBP_IE_CURRENCIES}
+
+def get_market_rule(currency):
+    if currency in EXPECTED_GBP_IE_CURRENCIES: return MARKET_RULE_GBP_IE
+    if currency in EXPECTED_EUROPE_CURRENCIES: return MARKET_RULE_EUROPE
+    return None
+
+# --- Helper Functions to Construct Product Display Names and Derived Columns ---
+def construct_product_display_names(df):
+    # Vectorized "Product Type - Product Model[ - Sofa Direction]"; N/A parts are skipped, direction only for chaise longues
+    def name_part(series):
+        text = series.astype(object).map(str, na_action='ignore')
+        return text.where(series.notna() & text.str.strip().str.upper().ne("N/A"))
+    is_chaise_longue = df['Product Type'].astype(object).map(str, na_action='ignore').str.strip().str.lower().eq("sofa chaise longue")
+    name_parts = [name_part(df['Product Type']), name_part(df['Product Model']), name_part(df['Sofa Direction']).where(is_chaise_longue)]
+    names = pd.Series("", index=df.index, dtype=object)
+    has_any_part = pd.Series(False, index=df.index)
+    for part in name_parts:
+        has_part = part.notna()
+        names = names.mask(has_part, names.mask(has_any_part, names + " - ") + part)
+        has_any_part = has_any_part | has_part
+    return names.mask(~has_any_part, "Unnamed Product")
+
+def derive_raw_data_columns(raw_df):
+    # All load-time derived/normalized columns in one pass; low-cardinality ones become categoricals
+    return raw_df.assign(**{
+        'Product Display Name': construct_product_display_names(raw_df).astype('category'),
+        'Base Color Cleaned': raw_df['Base Color'].astype(str).str.strip().replace("N/A", pd.NA).astype('category'),
+        'Upholstery Type': raw_df['Upholstery Type'].astype(str).str.strip().astype('category'),
+        'Market': raw_df['Market'].astype(str).str.upper().astype('category')
+    })
+
+# --- Helper Function to Clean Key Columns (Article No, Item No) ---
+def clean_key_series(series):
+    # Convert to string, strip whitespace, convert to uppercase, drop a trailing ".0" from integer-like floats
+    s_cleaned = series.astype(str).str.strip().str.upper().str.replace(r'\.0$', '', regex=True)
+    # Empty strings and common NA representations become missing keys
+    return s_cleaned.replace(['', 'NAN', '<NA>', 'NONE'], None)
+
+# --- Helper Functions for the Compact Catalog ---
+def compact_raw_data(raw_df, template_cols):
+    # Retain only required, derived and template columns; repeated text columns become categoricals
+    keep_cols = list(dict.fromkeys(RAW_DATA_REQUIRED_COLS + RAW_DATA_DERIVED_COLS + [col for col in template_cols if col in raw_df.columns]))
+    compact_df = raw_df[keep_cols].copy()
+    for col in keep_cols:
+        if col in RAW_DATA_KEY_COLS or isinstance(compact_df[col].dtype, pd.CategoricalDtype): continue
+        if pd.api.types.infer_dtype(compact_df[col], skipna=True) == 'string' and compact_df[col].nunique() <= len(compact_df) // 2:
+            compact_df[col] = compact_df[col].astype('category')
+    return compact_df
+
+def get_catalog_memory_footprint(catalog):
+    # Deep in-memory size in bytes of each catalog frame
+    footprint = {'raw_df': int(catalog['raw_df'].memory_usage(deep=True).sum()), 'item_no_positions': int(catalog['item_no_positions'].memory_usage(deep=True))}
+    for rule, market_view in catalog['market_views'].items():
+        footprint[f"market_view_{rule}"] = int(market_view.memory_usage(deep=True).sum())
+    for rule, price_indexes in catalog['price_index'].items():
+        for price_type, price_index in price_indexes.items():
+            footprint[f"{price_type}_prices_{rule}"] = int(price_index.memory_usage(deep=True).sum())
+    return footprint
+
+# --- Helper Functions for the Price Index ---
+def build_price_index(prices_df, currencies):
+    # Expected currency columns keyed by cleaned Article No (first column); first row wins for duplicate keys
+    if prices_df is None or prices_df.empty: return pd.DataFrame()
+    currency_cols = [col for col in prices_df.columns[1:] if col in currencies and str(col).lower() != str(prices_df.columns[0]).lower()]
+    price_index = prices_df[currency_cols].set_axis(clean_key_series(prices_df.iloc[:, 0]), axis=0)
+    price_index = price_index[price_index.index.notna()]
+    return price_index[~price_index.index.duplicated(keep='first')]
+
+def lookup_prices(price_index, article_nos, currency):
+    # One vectorized join of all article numbers against the index; returns a positional Series, unmatched -> NaN
+    if currency not in price_index.columns: return pd.Series([None] * len(article_nos), dtype=object)
+    keys = clean_key_series(pd.Series(list(article_nos), dtype=object))
+    return price_index[currency].reindex(keys).reset_index(drop=True)
+
+# --- Helper Function for the Per-Family Matrix Layouts ---
+def build_family_layouts(market_view):
+    # Family -> sorted products, sorted upholstery types and the matrix column map (type, color, swatch) in display order
+    family_layouts = {}
+    for family_name, family_df in market_view.groupby('Product Family', sort=True, observed=True):
+        upholstery_types_in_family = sorted(family_df['Upholstery Type'].dropna().unique())
+        data_column_map = []
+        for uph_type_clean in upholstery_types_in_family:
+            colors_for_type_df = family_df[family_df['Upholstery Type'] == uph_type_clean][['Upholstery Color', 'Image URL swatch']].drop_duplicates().sort_values(by='Upholstery Color', key=lambda col: col.astype(str) if col.dtype == object else col) # Mixed code columns sort as text
+            for color_val, swatch_val in zip(colors_for_type_df['Upholstery Color'], colors_for_type_df['Image URL swatch']):
+                data_column_map.append({'uph_type': uph_type_clean, 'uph_color': str(color_val), 'swatch': swatch_val})
+        family_layouts[family_name] = {
+            'products': sorted(family_df['Product Display Name'].dropna().unique()),
+            'upholstery_types': upholstery_types_in_family,
+            'data_column_map': data_column_map
+        }
+    return family_layouts
+
+def add_family_selection_masks(family_layouts, combo_ids):
+    # Adds a bitmask of the available combo IDs per matrix column to each layout,
+    # so a column's "all selected" state is a single AND/compare against the selection bitset
+    matrix_positions = {}
+    for family_name, layout in family_layouts.items():
+        layout['column_masks'] = [0] * len(layout['data_column_map'])
+        matrix_positions[family_name] = (set(layout['products']), {(col_entry['uph_type'], col_entry['uph_color']): col_pos for col_pos, col_entry in enumerate(layout['data_column_map'])})
+    for (family_name, prod_name, uph_type, uph_color), combo_id in combo_ids.items():
+        if family_name not in matrix_positions: continue
+        products_in_matrix, column_positions = matrix_positions[family_name]
+        col_pos = column_positions.get((uph_type, uph_color))
+        if prod_name in products_in_matrix and col_pos is not None:  # Otherwise not shown in the matrix
+            family_layouts[family_name]['column_masks'][col_pos] |= 1 << combo_id
+    return family_layouts
+
+def is_mask_selected(selection_bits, mask):
+    # True when the mask has combinations and all of them are selected
+    return mask != 0 and selection_bits & mask == mask
+
+def iter_mask_combo_ids(mask):
+    # Combo IDs of the set bits, ascending (= display order)
+    while mask:
+        lowest_bit = mask & -mask
+        yield lowest_bit.bit_length() - 1
+        mask ^= lowest_bit
+
+# --- Helper Functions for Bulk Selection ---
+COMBO_KEY_COLS = ['Product Family', 'Product Display Name', 'Upholstery Type', 'Upholstery Color']
+BULK_FILTER_COLS = COMBO_KEY_COLS + ['Product Type', 'Product Model', 'Sofa Direction']
+
+def build_combo_frame(raw_df, availability_index):
+    # One row per available combination (keys of the availability index) plus product attributes for filter expressions,
+    # sorted like the matrix (family, product, type, color) so bulk operations add items in display order
+    combo_df = pd.DataFrame(list(availability_index), columns=COMBO_KEY_COLS)
+    first_rows = [entry['rows'][0] for entry in availability_index.values()]
+    for col in BULK_FILTER_COLS[len(COMBO_KEY_COLS):]:
+        combo_df[col] = raw_df[col].iloc[first_rows].to_numpy()
+    return combo_df.sort_values(COMBO_KEY_COLS, key=lambda col: col.astype(str), kind='stable', ignore_index=True)
+
+# --- Helper Functions for the Availability Index ---
+def build_availability_index(raw_df, row_mask):
+    # (family, Product Display Name, Upholstery Type, Upholstery Color) -> matching raw_df row positions,
+    # unique base colors (first-seen order), the base resolution table (base color -> first row's Item No / Article No)
+    # and the first row's Item No / Article No.
+    row_positions = np.flatnonzero(row_mask.to_numpy())
+    if len(row_positions) == 0: return {}
+    view_df = raw_df.iloc[row_positions]
+    base_colors = view_df['Base Color Cleaned'].to_numpy()
+    item_nos, article_nos = view_df['Item No'].to_numpy(), view_df['Article No'].to_numpy()
+    grouped = view_df.groupby([view_df['Product Family'], view_df['Product Display Name'], view_df['Upholstery Type'], view_df['Upholstery Color'].astype(str)], sort=False, dropna=False, observed=True)
+    availability_index = {}
+    for combo_key, group_positions in grouped.indices.items():
+        first_pos = group_positions[0]
+        base_items = {}
+        for pos in group_positions:
+            if pd.notna(base_colors[pos]) and base_colors[pos] not in base_items: base_items[base_colors[pos]] = (item_nos[pos], article_nos[pos])
+        availability_index[combo_key] = {
+            'rows': row_positions[group_positions],
+            'base_colors': list(base_items),
+            'base_items': base_items,
+            'item_no': item_nos[first_pos],
+            'article_no': article_nos[first_pos]
+        }
+    return availability_index
+
+def make_generic_item_key(family, prod_name, uph_type, uph_color):
+    return f"{family}_{prod_name}_{uph_type}_{uph_color}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
+
+def build_generic_item_data(generic_item_key, family, prod_name, uph_type, uph_color, availability_entry):
+    unique_base_colors = availability_entry['base_colors']
+    return {
+        'key': generic_item_key, 'family': family, 'product': prod_name,
+        'upholstery_type': uph_type, 'upholstery_color': uph_color,
+        'requires_base_choice': len(unique_base_colors) > 1,
+        'available_bases': unique_base_colors if len(unique_base_colors) > 1 else [],
+        'item_no_if_single_base': availability_entry['item_no'] if len(unique_base_colors) <= 1 else None,
+        'article_no_if_single_base': availability_entry['article_no'] if len(unique_base_colors) <= 1 else None,
+        'resolved_base_if_single': unique_base_colors[0] if len(unique_base_colors) == 1 else (pd.NA if not unique_base_colors else None)
+    }
+
+# --- Load Data (sheets served from the columnar snapshot when fresh) ---
+def read_price_matrices(path, currencies):
+    # Both price sheets from one open of the workbook, keeping only the article column plus the expected currencies
+    price_sheets = read_excel_sheets(path, [PRICE_MATRIX_WHOLESALE_SHEET, PRICE_MATRIX_RETAIL_SHEET], wanted_columns=currencies)
+    return {'wholesale': price_sheets[PRICE_MATRIX_WHOLESALE_SHEET], 'retail': price_sheets[PRICE_MATRIX_RETAIL_SHEET]}
+
+CATALOG_SOURCE_PATHS = [RAW_DATA_XLSX_PATH, PRICE_MATRIX_EUROPE_XLSX_PATH, PRICE_MATRIX_GBP_IE_XLSX_PATH, MASTERDATA_TEMPLATE_XLSX_PATH]
+
+def get_file_signature(path):
+    # (mtime, size) of a source file, or None if missing. Any change invalidates the cached catalog.
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return (stat_result.st_mtime_ns, stat_result.st_size)
+
+def load_catalog_data(source_signatures, report_progress=None):
+    # Reads every source file and builds the compact catalog; errors are collected instead of raised.
+    # report_progress(stage, fraction) is called before each step, e.g. to drive a progress bar.
+    report_progress = report_progress or (lambda stage, fraction: None)
+    catalog = {
+        'raw_df': None, 'template_cols': None, 'market_views': {}, 'empty_view': None, 'family_layouts': {}, 'item_no_positions': None, 'availability_index': {}, 'combo_frames': {}, 'combo_keys': {}, 'combo_ids': {}, 'price_index': {},
+        'memory_footprint': {}, 'signatures': source_signatures, 'errors': []
+    }
+    errors = catalog['errors']
+    raw_df, price_matrices = None, {}
+
+    report_progress("Reading raw data", 0.0)
+    if os.path.exists(RAW_DATA_XLSX_PATH):
+        try:
+            raw_df = read_excel_sheet(RAW_DATA_XLSX_PATH, RAW_DATA_APP_SHEET)
+            missing = [col for col in RAW_DATA_REQUIRED_COLS if col not in raw_df.columns]
+            if missing:
+                errors.append(f"Required columns missing in '{os.path.basename(RAW_DATA_XLSX_PATH)}': {', '.join(missing)}.")
+            else:
+                raw_df = derive_raw_data_columns(raw_df)
+        except Exception as e: errors.append(f"Error loading Raw Data: {e}")
+    else: errors.append(f"Raw Data file not found: {RAW_DATA_XLSX_PATH}")
+
+    report_progress("Reading Europe price matrix", 0.4)
+    if not errors:
+        if os.path.exists(PRICE_MATRIX_EUROPE_XLSX_PATH):
+            try:
+                price_matrices[MARKET_RULE_EUROPE] = read_price_matrices(PRICE_MATRIX_EUROPE_XLSX_PATH, CURRENCIES_BY_RULE[MARKET_RULE_EUROPE])
+            except Exception as e: errors.append(f"Error loading EUROPE Prices: {e}")
+        else: errors.append(f"Price Matrix EUROPE file not found: {PRICE_MATRIX_EUROPE_XLSX_PATH}")
+
+    report_progress("Reading GBP/IE price matrix", 0.6)
+    if not errors:
+        if os.path.exists(PRICE_MATRIX_GBP_IE_XLSX_PATH):
+            try:
+                price_matrices[MARKET_RULE_GBP_IE] = read_price_matrices(PRICE_MATRIX_GBP_IE_XLSX_PATH, CURRENCIES_BY_RULE[MARKET_RULE_GBP_IE])
+            except Exception as e: errors.append(f"Error loading GBP/IE Prices: {e}")
+        else: errors.append(f"Price Matrix GBP/IE file not found: {PRICE_MATRIX_GBP_IE_XLSX_PATH}")
+
+    report_progress("Reading output template", 0.8)
+    if not errors:
+        if os.path.exists(MASTERDATA_TEMPLATE_XLSX_PATH):
+            try:
+                template_cols = pd.read_excel(MASTERDATA_TEMPLATE_XLSX_PATH).columns.tolist()
+                if "Wholesale price" not in template_cols: template_cols.append("Wholesale price")
+                if "Retail price" not in template_cols: template_cols.append("Retail price")
+                catalog['template_cols'] = template_cols
+            except Exception as e: errors.append(f"Error loading Template: {e}")
+        else: errors.append(f"Template file not found: {MASTERDATA_TEMPLATE_XLSX_PATH}")
+
+    report_progress("Building indexes", 0.85)
+    if not errors:
+        # Keep only what the app uses: compact raw data plus indexes; the source price frames are dropped
+        raw_df = compact_raw_data(raw_df, catalog['template_cols'])
+        first_item_rows = ~raw_df['Item No'].duplicated(keep='first')
+        catalog['raw_df'] = raw_df
+        catalog['item_no_positions'] = pd.Series(np.flatnonzero(first_item_rows.to_numpy()), index=raw_df.loc[first_item_rows, 'Item No'].to_numpy())
+        market_masks = {rule: raw_df['Market'] != excluded_market for rule, excluded_market in EXCLUDED_MARKET_BY_RULE.items()}
+        catalog['market_views'] = {rule: raw_df[market_mask] for rule, market_mask in market_masks.items()}
+        catalog['empty_view'] = raw_df.iloc[:0]
+        catalog['family_layouts'] = {rule: build_family_layouts(market_view) for rule, market_view in catalog['market_views'].items()}
+        catalog['availability_index'] = {rule: build_availability_index(raw_df, market_mask) for rule, market_mask in market_masks.items()}
+        catalog['combo_frames'] = {rule: build_combo_frame(raw_df, availability_index) for rule, availability_index in catalog['availability_index'].items()}
+        # Integer combo IDs per market rule (combination frame row positions); selection state stores these instead of string keys
+        catalog['combo_keys'] = {rule: list(combo_df[COMBO_KEY_COLS].itertuples(index=False, name=None)) for rule, combo_df in catalog['combo_frames'].items()}
+        catalog['combo_ids'] = {rule: {combo_key: combo_id for combo_id, combo_key in enumerate(combo_keys)} for rule, combo_keys in catalog['combo_keys'].items()}
+        for rule, family_layouts in catalog['family_layouts'].items(): add_family_selection_masks(family_layouts, catalog['combo_ids'].get(rule, {}))
+        catalog['price_index'] = {rule: {price_type: build_price_index(prices_df, CURRENCIES_BY_RULE[rule]) for price_type, prices_df in matrices.items()} for rule, matrices in price_matrices.items()}
+        catalog['memory_footprint'] = get_catalog_memory_footprint(catalog)
+
+    report_progress("Ready", 1.0)
+    return catalog
+
+# --- Selection Resolution (combinations are addressed by their integer combo ID within a market rule) ---
+def get_combo_item_data(catalog, market_rule, combo_id):
+    # Generic item data for a combination; 'key' is the string form used for widget IDs only
+    combo_key = catalog['combo_keys'][market_rule][combo_id]
+    gen_item_data = build_generic_item_data(make_generic_item_key(*combo_key), *combo_key, catalog['availability_index'][market_rule][combo_key])
+    gen_item_data['combo_id'] = combo_id
+    return gen_item_data
+
+def resolve_generic_item(catalog, market_rule, combo_id, chosen_bases):
+    # Final (Item No, Article No, base) entries for one matrix selection
+    gen_item_data = get_combo_item_data(catalog, market_rule, combo_id)
+    description = f"{gen_item_data['family']} / {gen_item_data['product']} / {gen_item_data['upholstery_type']} / {gen_item_data['upholstery_color']}"
+    if not gen_item_data['requires_base_choice']:
+        if gen_item_data.get('item_no_if_single_base') is None: return []
+        return [{"description": description + (f" / Base: {gen_item_data['resolved_base_if_single']}" if pd.notna(gen_item_data['resolved_base_if_single']) else ""), "item_no": gen_item_data['item_no_if_single_base'], "article_no": gen_item_data['article_no_if_single_base'], "combo_id": combo_id}]
+    base_items = catalog['availability_index'][market_rule][catalog['combo_keys'][market_rule][combo_id]]['base_items']
+    resolved_items = []
+    for bc in chosen_bases:
+        if bc in base_items:
+            item_no, article_no = base_items[bc]
+            resolved_items.append({"description": f"{description} / Base: {bc}", "item_no": item_no, "article_no": article_no, "combo_id": combo_id, "chosen_base": bc})
+    return resolved_items
+
+# --- Filter Expressions (bulk selection box and CLI spec "filter") ---
+# User text is never evaluated: it is parsed with ast and only comparisons of backticked BULK_FILTER_COLS columns
+# against constants (or lists of constants for in / not in), combined with and / or / not, are accepted.
+FILTER_COMPARE_OPERATORS = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+FILTER_COLUMN_PATTERN = re.compile(r"`([^`]*)`")
+
+def _describe_filter_node(node, column_names):
+    # Expression text for error messages, with column placeholders shown as the backticked names the user typed
+    text = ast.unparse(node)
+    for placeholder, column_name in column_names.items(): text = text.replace(placeholder, f"`{column_name}`")
+    return text
+
+def _filter_operand(node, df, column_names):
+    # Column Series or constant value for one side of a comparison
+    if isinstance(node, ast.Name) and node.id in column_names:
+        return df[column_names[node.id]]
+    if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float, bool, type(None))):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant) and isinstance(node.operand.value, (int, float)):
+        return -node.operand.value
+    raise ValueError(f"Unsupported operand '{_describe_filter_node(node, column_names)}'. Use a backticked column name or a constant.")
+
+def _filter_mask(node, df, column_names):
+    if isinstance(node, ast.BoolOp):
+        masks = [_filter_mask(value, df, column_names) for value in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        mask = masks[0]
+        for other_mask in masks[1:]: mask = combine(mask, other_mask)
+        return mask
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ~_filter_mask(node.operand, df, column_names)
+    if isinstance(node, ast.Compare):
+        mask, left = pd.Series(True, index=df.index), node.left
+        for compare_op, right in zip(node.ops, node.comparators):
+            if isinstance(compare_op, (ast.In, ast.NotIn)):
+                if not isinstance(right, (ast.List, ast.Tuple)): raise ValueError("'in' needs a list of constants, e.g. `Upholstery Color` in ['151', '171'].")
+                column = _filter_operand(left, df, column_names)
+                if not isinstance(column, pd.Series): raise ValueError("'in' needs a backticked column name on the left.")
+                is_in = column.isin([_filter_operand(element, df, column_names) for element in right.elts])
+                mask &= ~is_in if isinstance(compare_op, ast.NotIn) else is_in
+            elif type(compare_op) in FILTER_COMPARE_OPERATORS:
+                compared = FILTER_COMPARE_OPERATORS[type(compare_op)](_filter_operand(left, df, column_names), _filter_operand(right, df, column_names))
+                if not isinstance(compared, pd.Series): raise ValueError(f"Comparison '{_describe_filter_node(node, column_names)}' does not use a column.")
+                mask &= compared.fillna(False).astype(bool)
+            else: raise ValueError(f"Unsupported comparison operator in '{_describe_filter_node(node, column_names)}'.")
+            left = right
+        return mask
+    raise ValueError(f"Unsupported filter syntax '{_describe_filter_node(node, column_names)}'. Use comparisons joined by and / or / not.")
+
+def evaluate_filter_expr(df, filter_expr):
+    """Boolean mask of df rows matching a filter expression such as "`Product Type` == 'Sofa' and `Upholstery Color` != '151'".
+
+    Raises ValueError for anything but comparisons on backticked BULK_FILTER_COLS columns
+    (no attribute access, calls, subscripts or variables).
+    """
+    column_names = {}
+    def to_placeholder(match):
+        if match.group(1) not in BULK_FILTER_COLS or match.group(1) not in df.columns:
+            raise ValueError(f"Unknown filter column '{match.group(1)}'. Available: {', '.join(BULK_FILTER_COLS)}.")
+        placeholder = f"_filter_column_{len(column_names)}"
+        column_names[placeholder] = match.group(1)
+        return placeholder
+    try:
+        expr_tree = ast.parse(FILTER_COLUMN_PATTERN.sub(to_placeholder, filter_expr).strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(e.msg) from None
+    try:
+        return _filter_mask(expr_tree.body, df, column_names)
+    except TypeError as e:
+        raise ValueError(f"Cannot compare these values: {e}") from None
+
+def find_combos(catalog, market_rule, family=None, uph_type=None, prod_name=None, uph_color=None, filter_expr=None):
+    # Set-based match against the combination frame (row position = combo ID): equality filters plus an optional
+    # filter expression (see evaluate_filter_expr)
+    combo_df = catalog['combo_frames'].get(market_rule)
+    if combo_df is None or combo_df.empty: return []
+    match_mask = pd.Series(True, index=combo_df.index)
+    for col, value in zip(COMBO_KEY_COLS, (family, prod_name, uph_type, uph_color)):
+        if value is not None: match_mask &= combo_df[col] == value
+    matched_df = combo_df[match_mask]
+    if filter_expr: matched_df = matched_df[evaluate_filter_expr(matched_df, filter_expr)]
+    return matched_df.index.tolist()
+
+def dedupe_final_items(resolved_items):
+    # One entry per Item No and chosen base, first occurrence wins
+    final_items, seen_item_keys = [], set()
+    for item in resolved_items:
+        unique_config_key = f"{item['item_no']}_{item.get('chosen_base', 'NO_BASE_APPLICABLE')}"
+        if unique_config_key not in seen_item_keys:
+            final_items.append(item)
+            seen_item_keys.add(unique_config_key)
+    return final_items
+
+def resolve_selection_spec(catalog, currency, spec_entries):
+    # Selection spec entries -> (final items for export, warnings), in spec order
+    market_rule = get_market_rule(currency)
+    resolved_items, warnings = [], []
+    for spec_entry in spec_entries:
+        combo_ids = find_combos(catalog, market_rule, family=spec_entry.get('family'), uph_type=spec_entry.get('upholstery_type'), prod_name=spec_entry.get('product'),
+                                 uph_color=None if spec_entry.get('upholstery_color') is None else str(spec_entry['upholstery_color']), filter_expr=spec_entry.get('filter'))
+        if not combo_ids: warnings.append(f"No combinations match {spec_entry} for {currency}.")
+        for combo_id in combo_ids:
+            gen_item_data = get_combo_item_data(catalog, market_rule, combo_id)
+            chosen_bases = spec_entry.get('base_colors') or []
+            if chosen_bases == "all": chosen_bases = gen_item_data['available_bases']
+            if gen_item_data['requires_base_choice'] and not chosen_bases:
+                warnings.append(f"{gen_item_data['key']} requires a base color choice. Skipping."); continue
+            resolved_items.extend(resolve_generic_item(catalog, market_rule, combo_id, chosen_bases))
+    return dedupe_final_items(resolved_items), warnings
+
+# --- Master Data Export ---
+def get_output_columns(template_cols, currency):
+    # Template columns with the generic price columns renamed for the currency
+    ws_price_col_dyn, rt_price_col_dyn = f"Wholesale price ({currency})", f"Retail price ({currency})"
+    final_output_cols, seen_cols = [], set()
+    for col_temp in template_cols:
+        target_col = ws_price_col_dyn if col_temp.lower() == "wholesale price" else (rt_price_col_dyn if col_temp.lower() == "retail price" else col_temp)
+        if target_col not in seen_cols: final_output_cols.append(target_col); seen_cols.add(target_col)
+    if ws_price_col_dyn not in final_output_cols: final_output_cols.append(ws_price_col_dyn)
+    if rt_price_col_dyn not in final_output_cols: final_output_cols.append(rt_price_col_dyn)
+    return final_output_cols
+
+def build_master_data_frame(catalog, final_items, currency):
+    # Returns (output DataFrame or None, warnings). Raises ValueError if the currency cannot be priced.
+    if currency in EXPECTED_GBP_IE_CURRENCIES:
+        if MARKET_RULE_GBP_IE not in catalog['price_index']: raise ValueError("GBP/IE price matrix not loaded.")
+    elif currency in EXPECTED_EUROPE_CURRENCIES:
+        if MARKET_RULE_EUROPE not in catalog['price_index']: raise ValueError("Europe price matrix not loaded.")
+    else: raise ValueError(f"Currency '{currency}' not configured.")
+    if catalog['raw_df'] is None: raise ValueError("Raw data unavailable.")
+    price_index_for_dl = catalog['price_index'][get_market_rule(currency)]
+    ws_prices, rt_prices = price_index_for_dl['wholesale'], price_index_for_dl['retail']
+    ws_price_col_dyn, rt_price_col_dyn = f"Wholesale price ({currency})", f"Retail price ({currency})"
+    final_output_cols = get_output_columns(catalog['template_cols'], currency)
+    warnings = []
+
+    # Join the selection against raw data (first row per Item No) and both price indexes in one pass each
+    selection_df = pd.DataFrame(final_items, columns=['item_no', 'article_no'])
+    item_no_positions = catalog['item_no_positions']
+    item_positions = item_no_positions.index.get_indexer(selection_df['item_no'])
+    found_mask = item_positions >= 0
+    for missing_item_no in selection_df.loc[~found_mask, 'item_no']: warnings.append(f"Item No {missing_item_no} not found. Skipping.")
+    if not found_mask.any(): return None, warnings
+    item_rows_df = catalog['raw_df'].iloc[item_no_positions.to_numpy()[item_positions[found_mask]]].reset_index(drop=True)
+    article_nos_for_dl = selection_df.loc[found_mask, 'article_no']
+
+    product_source_col = "Item Name"
+    if product_source_col not in item_rows_df.columns:
+        warnings.append("Kolonnen 'Item Name' blev ikke fundet i rådata. 'Product'-kolonnen i output kan være tom.")
+        product_source_col = "Product Display Name" # Fallback to Product Display Name if Item Name is missing
+
+    output_columns = {}
+    for template_col_name in final_output_cols:
+        if template_col_name == ws_price_col_dyn:
+            if ws_prices.empty: output_columns[template_col_name] = "Wholesale Matrix Empty"
+            else: output_columns[template_col_name] = lookup_prices(ws_prices, article_nos_for_dl, currency).astype(object).fillna("Price Not Found")
+        elif template_col_name == rt_price_col_dyn:
+            if rt_prices.empty: output_columns[template_col_name] = "Retail Matrix Empty"
+            else: output_columns[template_col_name] = lookup_prices(rt_prices, article_nos_for_dl, currency).astype(object).fillna("Price Not Found")
+        elif template_col_name.strip().lower() == "product":
+            output_columns[template_col_name] = item_rows_df.get(product_source_col)
+        elif template_col_name in item_rows_df.columns:
+            output_columns[template_col_name] = item_rows_df[template_col_name]
+        else:
+            output_columns[template_col_name] = None
+    return pd.DataFrame(output_columns, index=item_rows_df.index, columns=final_output_cols), warnings
+
+XLSX_STREAM_CHUNK_ROWS = 5000
+
+def iter_output_rows(output_df, chunk_rows=XLSX_STREAM_CHUNK_ROWS):
+    # Plain Python rows (missing values -> None), converted one chunk at a time
+    for chunk_start in range(0, len(output_df), chunk_rows):
+        chunk_df = output_df.iloc[chunk_start:chunk_start + chunk_rows].astype(object)
+        yield from chunk_df.where(chunk_df.notna(), None).to_numpy().tolist()
+
+def write_master_data_workbook(frames_by_sheet, output_path=None):
+    # One workbook, one sheet per entry (sheet name -> output DataFrame), streamed row by row in xlsxwriter's
+    # constant_memory mode so only the current row is held in memory. Written to output_path, or returned as bytes.
+    if output_path is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, "masterdata_output.xlsx")
+            write_master_data_workbook(frames_by_sheet, tmp_path)
+            with open(tmp_path, 'rb') as f: return f.read()
+    workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}) # Same header look as pandas' to_excel
+    for sheet_name, output_df in frames_by_sheet.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(col) for col in output_df.columns], header_format)
+        for row_num, row_values in enumerate(iter_output_rows(output_df), start=1):
+            worksheet.write_row(row_num, 0, row_values)
+    workbook.close()
+    return output_path
+
+def write_master_data_xlsx(output_df, output_path=None):
+    return write_master_data_workbook({'Masterdata Output': output_df}, output_path)
+
+PRICE_COLUMN_PREFIXES = ("Wholesale price (", "Retail price (")
+PRICE_STATUS_SUFFIX = " status"
+
+def to_typed_price_frame(output_df):
+    # For typed formats: price columns numeric (missing prices -> null), with the text status ("Price Not Found",
+    # "... Matrix Empty") moved to a "<price column> status" column right after each price column (null when priced)
+    typed_columns = {}
+    for col in output_df.columns:
+        if not (isinstance(col, str) and col.startswith(PRICE_COLUMN_PREFIXES)):
+            typed_columns[col] = output_df[col]; continue
+        prices = pd.to_numeric(output_df[col], errors='coerce').astype('float64')
+        typed_columns[col] = prices
+        typed_columns[f"{col}{PRICE_STATUS_SUFFIX}"] = output_df[col].astype(object).where(prices.isna() & output_df[col].notna(), None)
+    return pd.DataFrame(typed_columns, index=output_df.index)
+
+# Output formats. XLSX and CSV have exactly the template-ordered columns of build_master_data_frame.
+# Parquet and JSON Lines keep prices numeric and add a "<price column> status" column after each price column
+# (see to_typed_price_frame)
+EXPORT_FORMATS = {
+    'xlsx': {'label': "Excel (XLSX)", 'extension': "xlsx", 'mime': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    'csv': {'label': "CSV", 'extension': "csv", 'mime': "text/csv"},
+    'parquet': {'label': "Parquet", 'extension': "parquet", 'mime': "application/vnd.apache.parquet"},
+    'jsonl': {'label': "JSON Lines", 'extension': "jsonl", 'mime': "application/x-ndjson"},
+}
+DEFAULT_EXPORT_FORMAT = 'xlsx'
+
+def write_master_data(output_df, export_format=DEFAULT_EXPORT_FORMAT, output_path=None):
+    # Writes the output frame in the given format to output_path, or returns the file as bytes
+    if export_format == 'xlsx': return write_master_data_xlsx(output_df, output_path)
+    if export_format not in EXPORT_FORMATS: raise ValueError(f"Export format '{export_format}' not supported.")
+    target = output_path or io.BytesIO()
+    if export_format == 'csv': output_df.to_csv(target, index=False, encoding='utf-8')
+    elif export_format == 'jsonl': to_typed_price_frame(output_df).to_json(target, orient='records', lines=True, force_ascii=False)
+    else: pq.write_table(to_arrow_table(to_typed_price_frame(output_df)), target) # Other mixed number/text columns are stored as text
+    return output_path or target.getvalue()
+
+def get_export_file_name(currency, export_format=DEFAULT_EXPORT_FORMAT):
+    return f"masterdata_output_{currency.replace(' ', '_').replace('.', '')}.{EXPORT_FORMATS[export_format]['extension']}"
+
+ALL_CURRENCIES_FILE_NAME = "masterdata_output_all_currencies.xlsx"
+
+# --- Multi-Currency Export (currencies are independent, so they fan out over a worker pool) ---
+_pool_catalog = None  # Catalog shared with pool workers: inherited on fork, read directly by threads
+
+def export_currency(catalog, spec_entries, currency):
+    # (output DataFrame or None, messages) for one currency
+    final_items, warnings = resolve_selection_spec(catalog, currency, spec_entries)
+    output_df, frame_warnings = build_master_data_frame(catalog, final_items, currency) if final_items else (None, [])
+    return output_df, warnings + frame_warnings
+
+def _export_currency_job(spec_entries, currency, output_path, export_format):
+    # Pool job: per-currency files are written to disk by the worker; single-workbook sheets return the frame
+    output_df, messages = export_currency(_pool_catalog, spec_entries, currency)
+    if output_df is None: return None, 0, messages
+    return (write_master_data(output_df, export_format, output_path) if output_path else output_df), len(output_df), messages
+
+def run_currency_jobs(catalog, spec_entries, currencies, output_paths, workers=1, export_format=DEFAULT_EXPORT_FORMAT):
+    # Results in currency order. Uses a fork-started process pool where available (no catalog re-read or pickling),
+    # otherwise a thread pool over the same in-memory catalog.
+    global _pool_catalog
+    _pool_catalog = catalog
+    if workers <= 1 or len(currencies) <= 1:
+        return [_export_currency_job(spec_entries, currency, output_path, export_format) for currency, output_path in zip(currencies, output_paths)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        return list(executor.map(_export_currency_job, [spec_entries] * len(currencies), currencies, output_paths, [export_format] * len(currencies)))
+
+def export_currencies(catalog, spec_entries, currencies, output_dir, workers=1, single_workbook=False, export_format=DEFAULT_EXPORT_FORMAT):
+    # One file per currency, or one XLSX workbook with a sheet per currency; returns the written paths
+    if single_workbook and export_format != 'xlsx': raise ValueError("A single workbook with one sheet per currency is only available for XLSX.")
+    os.makedirs(output_dir, exist_ok=True)
+    written_paths, frames_by_sheet = [], {}
+    output_paths = [None if single_workbook else os.path.join(output_dir, get_export_file_name(currency, export_format)) for currency in currencies]
+    for currency, (result, row_count, messages) in zip(currencies, run_currency_jobs(catalog, spec_entries, currencies, output_paths, workers, export_format)):
+        for message in messages: print(f"[{currency}] Warning: {message}")
+        if result is None:
+            print(f"[{currency}] No data to output."); continue
+        if single_workbook:
+            frames_by_sheet[currency] = result
+            continue
+        print(f"[{currency}] Wrote {row_count} rows to {result}")
+        written_paths.append(result)
+    if frames_by_sheet:
+        output_path = os.path.join(output_dir, ALL_CURRENCIES_FILE_NAME)
+        write_master_data_workbook(frames_by_sheet, output_path)
+        print(f"Wrote {len(frames_by_sheet)} currency sheets to {output_path}")
+        written_paths.append(output_path)
+    return written_paths
+
+# --- Batch Export CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Muuto master data files without the Streamlit UI.")
+    currency_group = parser.add_mutually_exclusive_group(required=True)
+    currency_group.add_argument("--currency", action="append", help="Currency to export (repeatable), e.g. DKK or 'IE - EUR'.")
+    currency_group.add_argument("--all-currencies", action="store_true", help="Export every expected Europe and GBP/IE currency.")
+    parser.add_argument("--spec", required=True, help="Selection spec JSON file.")
+    parser.add_argument("--output-dir", default=".", help="Directory for the generated files.")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default=DEFAULT_EXPORT_FORMAT, help="Output file format.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Currencies exported in parallel (1 = serial).")
+    parser.add_argument("--single-workbook", action="store_true", help=f"Write one workbook ({ALL_CURRENCIES_FILE_NAME}) with a sheet per currency.")
+    args = parser.parse_args(argv)
+
+    with open(args.spec, encoding="utf-8") as f: spec_entries = json.load(f)
+    catalog = load_catalog_data(tuple(get_file_signature(path) for path in CATALOG_SOURCE_PATHS))
+    if catalog['errors']:
+        for catalog_error in catalog['errors']: print(f"Error: {catalog_error}")
+        return 1
+    currencies = EXPECTED_EUROPE_CURRENCIES + EXPECTED_GBP_IE_CURRENCIES if args.all_currencies else args.currency
+    unknown_currencies = [currency for currency in currencies if get_market_rule(currency) is None]
+    if unknown_currencies: parser.error(f"Currency not configured: {', '.join(unknown_currencies)}")
+    if args.single_workbook and args.format != 'xlsx': parser.error("--single-workbook requires --format xlsx")
+    export_currencies(catalog, spec_entries, currencies, args.output_dir, workers=args.workers, single_workbook=args.single_workbook, export_format=args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,7 +1,14 @@
 import streamlit as st
 import pandas as pd
-import io
 import os
+import html
+import threading
+from swatch_cache import request_swatches, get_swatch_sprite_url
+from master_data import (
+    BASE_DIR, MARKET_RULE_EUROPE, MARKET_RULE_GBP_IE, BULK_FILTER_COLS, CATALOG_SOURCE_PATHS,
+    get_market_rule, get_file_signature, load_catalog_data, get_combo_item_data, find_combos, is_mask_selected, iter_mask_combo_ids, resolve_generic_item as resolve_catalog_item,
+    dedupe_final_items, build_master_data_frame, write_master_data, get_export_file_name, EXPORT_FORMATS, DEFAULT_EXPORT_FORMAT,
+)
 
 # --- Page Configuration (MUST BE THE FIRST STREAMLIT COMMAND) ---
 st.set_page_config(
@@ -10,31 +17,12 @@ st.set_page_config(
     page_icon="favicon.png"  # Ensure this file exists or remove/replace
 )
 
-# --- Configuration & Constants ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-RAW_DATA_XLSX_PATH = os.path.join(BASE_DIR, "raw-data.xlsx")
-PRICE_MATRIX_EUROPE_XLSX_PATH = os.path.join(BASE_DIR, "price-matrix_EUROPE.xlsx")
-PRICE_MATRIX_GBP_IE_XLSX_PATH = os.path.join(BASE_DIR, "price-matrix_GBP-IE.xlsx") 
-MASTERDATA_TEMPLATE_XLSX_PATH = os.path.join(BASE_DIR, "Masterdata-output-template.xlsx")
+# --- Configuration & Constants (catalog paths, currencies and market rules live in master_data) ---
 LOGO_PATH = os.path.join(BASE_DIR, "muuto_logo.png")
 
-RAW_DATA_APP_SHEET = "APP"
-PRICE_MATRIX_WHOLESALE_SHEET = "Price matrix wholesale"
-PRICE_MATRIX_RETAIL_SHEET = "Price matrix retail"
-
 DEFAULT_NO_SELECTION = "--- Please Select ---"
 
-# --- Helper Function to Construct Product Display Name ---
-def construct_product_display_name(row):
-    name_parts = []
-    product_type = row.get('Product Type')
-    product_model = row.get('Product Model')
-    sofa_direction = row.get('Sofa Direction')
-    if pd.notna(product_type) and str(product_type).strip().upper() != "N/A": name_parts.append(str(product_type))
-    if pd.notna(product_model) and str(product_model).strip().upper() != "N/A": name_parts.append(str(product_model))
-    if str(product_type).strip().lower() == "sofa chaise longue":
-        if pd.notna(sofa_direction) and str(sofa_direction).strip().upper() != "N/A": name_parts.append(str(sofa_direction))
-    return " - ".join(name_parts) if name_parts else "Unnamed Product"
+BULK_ALL_OPTION = "All"
 
 # --- Main App Logic ---
 
@@ -67,89 +55,186 @@ This tool simplifies selecting MTO products and generating the data you need for
 * **Step 3: Review selections:**
     * Review the final list of configured products. You can remove items from this list if needed.
 * **Step 4: Generate master data file:**
-    * After making your selections, generate and download an Excel file containing all master data for your selected items.
+    * After making your selections, generate and download a file containing all master data for your selected items: Excel, or CSV, Parquet and JSON Lines for faster system imports.
 """)
 
 # --- Initialize session state variables ---
-if 'raw_df' not in st.session_state: st.session_state.raw_df = None
-if 'wholesale_prices_df' not in st.session_state: st.session_state.wholesale_prices_df = None
-if 'retail_prices_df' not in st.session_state: st.session_state.retail_prices_df = None
-if 'wholesale_prices_gbp_ie_df' not in st.session_state: st.session_state.wholesale_prices_gbp_ie_df = None
-if 'retail_prices_gbp_ie_df' not in st.session_state: st.session_state.retail_prices_gbp_ie_df = None
 if 'filtered_raw_df' not in st.session_state: st.session_state.filtered_raw_df = None
-if 'template_cols' not in st.session_state: st.session_state.template_cols = None
 if 'selected_family_session' not in st.session_state: st.session_state.selected_family_session = None
-if 'matrix_selected_generic_items' not in st.session_state: st.session_state.matrix_selected_generic_items = {}
+# Matrix selection: bit i set = combo ID i of the current market rule is selected (see catalog['combo_ids'])
+if 'matrix_selection_bits' not in st.session_state: st.session_state.matrix_selection_bits = 0
 if 'user_chosen_base_colors_for_items' not in st.session_state: st.session_state.user_chosen_base_colors_for_items = {}
+if 'resolved_items_by_combo' not in st.session_state: st.session_state.resolved_items_by_combo = {}
+# Catalog build the combo IDs above refer to: its source signatures and combo ID -> combination key lists
+if 'selection_catalog_signatures' not in st.session_state: st.session_state.selection_catalog_signatures = None
+if 'selection_combo_keys' not in st.session_state: st.session_state.selection_combo_keys = {}
 if 'final_items_for_download' not in st.session_state: st.session_state.final_items_for_download = []
 if 'selected_currency_session' not in st.session_state: st.session_state.selected_currency_session = None
-
-
-# --- Load Data Directly from XLSX files ---
-files_loaded_successfully = True
-
-if st.session_state.raw_df is None:
-    if os.path.exists(RAW_DATA_XLSX_PATH):
-        try:
-            st.session_state.raw_df = pd.read_excel(RAW_DATA_XLSX_PATH, sheet_name=RAW_DATA_APP_SHEET)
-            required_cols = ['Product Type', 'Product Model', 'Sofa Direction', 'Base Color', 'Product Family', 'Item No', 'Article No', 'Image URL swatch', 'Upholstery Type', 'Upholstery Color', 'Market', 'Item Name'] # Added 'Item Name'
-            missing = [col for col in required_cols if col not in st.session_state.raw_df.columns]
-            if missing:
-                st.error(f"Required columns missing in '{os.path.basename(RAW_DATA_XLSX_PATH)}': {', '.join(missing)}.")
-                files_loaded_successfully = False
-            else:
-                st.session_state.raw_df['Product Display Name'] = st.session_state.raw_df.apply(construct_product_display_name, axis=1)
-                st.session_state.raw_df['Base Color Cleaned'] = st.session_state.raw_df['Base Color'].astype(str).str.strip().replace("N/A", pd.NA)
-                st.session_state.raw_df['Upholstery Type'] = st.session_state.raw_df['Upholstery Type'].astype(str).str.strip()
-                st.session_state.raw_df['Market'] = st.session_state.raw_df['Market'].astype(str).str.upper()
-        except Exception as e: st.error(f"Error loading Raw Data: {e}"); files_loaded_successfully = False
-    else: st.error(f"Raw Data file not found: {RAW_DATA_XLSX_PATH}"); files_loaded_successfully = False
-
-if files_loaded_successfully and st.session_state.wholesale_prices_df is None:
-    if os.path.exists(PRICE_MATRIX_EUROPE_XLSX_PATH):
-        try:
-            st.session_state.wholesale_prices_df = pd.read_excel(PRICE_MATRIX_EUROPE_XLSX_PATH, sheet_name=PRICE_MATRIX_WHOLESALE_SHEET)
-            st.session_state.retail_prices_df = pd.read_excel(PRICE_MATRIX_EUROPE_XLSX_PATH, sheet_name=PRICE_MATRIX_RETAIL_SHEET)
-        except Exception as e: st.error(f"Error loading EUROPE Prices: {e}"); files_loaded_successfully = False
-    else: st.error(f"Price Matrix EUROPE file not found: {PRICE_MATRIX_EUROPE_XLSX_PATH}"); files_loaded_successfully = False
-
-if files_loaded_successfully and st.session_state.wholesale_prices_gbp_ie_df is None:
-    if os.path.exists(PRICE_MATRIX_GBP_IE_XLSX_PATH):
-        try:
-            st.session_state.wholesale_prices_gbp_ie_df = pd.read_excel(PRICE_MATRIX_GBP_IE_XLSX_PATH, sheet_name=PRICE_MATRIX_WHOLESALE_SHEET)
-            st.session_state.retail_prices_gbp_ie_df = pd.read_excel(PRICE_MATRIX_GBP_IE_XLSX_PATH, sheet_name=PRICE_MATRIX_RETAIL_SHEET)
-        except Exception as e: st.error(f"Error loading GBP/IE Prices: {e}"); files_loaded_successfully = False
-    else: st.error(f"Price Matrix GBP/IE file not found: {PRICE_MATRIX_GBP_IE_XLSX_PATH}"); files_loaded_successfully = False
-
-
-if files_loaded_successfully and st.session_state.template_cols is None:
-    if os.path.exists(MASTERDATA_TEMPLATE_XLSX_PATH):
+if 'export_cache' not in st.session_state: st.session_state.export_cache = None
+if 'matrix_grid_mode' not in st.session_state: st.session_state.matrix_grid_mode = False
+if 'matrix_grid_version' not in st.session_state: st.session_state.matrix_grid_version = 0
+if 'export_format_choice' not in st.session_state: st.session_state.export_format_choice = DEFAULT_EXPORT_FORMAT
+if 'pending_toasts' not in st.session_state: st.session_state.pending_toasts = []
+
+# --- Load Data (process-wide catalog, shared by all sessions; sheets served from the columnar snapshot when fresh) ---
+@st.cache_resource(max_entries=1, show_spinner=False)
+def start_catalog_warmup(source_signatures):
+    # The first script run in the process starts loading in a background thread; every session polls the same holder.
+    # Loaded once per process and shared by every session. Treat all frames as read-only.
+    catalog_warmup = {'catalog': None, 'stage': "Starting", 'progress': 0.0}
+    def report_progress(stage, fraction): catalog_warmup.update(stage=stage, progress=fraction)
+    def load_in_background():
         try:
-            st.session_state.template_cols = pd.read_excel(MASTERDATA_TEMPLATE_XLSX_PATH).columns.tolist()
-            if "Wholesale price" not in st.session_state.template_cols: st.session_state.template_cols.append("Wholesale price")
-            if "Retail price" not in st.session_state.template_cols: st.session_state.template_cols.append("Retail price")
-        except Exception as e: st.error(f"Error loading Template: {e}"); files_loaded_successfully = False
-    else: st.error(f"Template file not found: {MASTERDATA_TEMPLATE_XLSX_PATH}"); files_loaded_successfully = False
+            catalog = load_catalog_data(source_signatures, report_progress)
+        except Exception as e:
+            catalog = {'signatures': source_signatures, 'errors': [f"Error building catalog: {e}"]}
+        catalog_warmup['catalog'] = catalog
+        if not catalog['errors']:
+            # Queue every matrix swatch for the thumbnail cache so Step 2 renders from it instead of waiting on downloads
+            request_swatches(col_entry['swatch'] for family_layouts in catalog['family_layouts'].values()
+                             for family_layout in family_layouts.values() for col_entry in family_layout['data_column_map'])
+    threading.Thread(target=load_in_background, name="catalog-warmup", daemon=True).start()
+    return catalog_warmup
+
+catalog_warmup = start_catalog_warmup(tuple(get_file_signature(path) for path in CATALOG_SOURCE_PATHS))
+
+@st.fragment(run_every=1)
+def render_catalog_warmup_progress():
+    # Polls the warm-up without blocking the page; the full app renders once the catalog is ready
+    if catalog_warmup['catalog'] is not None: st.rerun(scope="app")
+    st.progress(catalog_warmup['progress'], text=f"Loading product catalog: {catalog_warmup['stage']}...")
+
+if catalog_warmup['catalog'] is None:
+    render_catalog_warmup_progress()
+    st.stop()
+
+catalog = catalog_warmup['catalog']
+for catalog_error in catalog['errors']: st.error(catalog_error)
+files_loaded_successfully = not catalog['errors']
+
+# --- Toasts from fragment callbacks ---
+# A callback that triggers a fragment rerun must not display elements, so it queues its toast for the fragment body
+def queue_toast(message, icon):
+    st.session_state.pending_toasts.append((message, icon))
+
+def show_pending_toasts():
+    for message, icon in st.session_state.pending_toasts: st.toast(message, icon=icon)
+    st.session_state.pending_toasts = []
+
+# --- Incremental Final-Selection Helpers ---
+def get_current_market_rule():
+    return get_market_rule(st.session_state.selected_currency_session)
+
+def is_combo_selected(combo_id):
+    return bool(st.session_state.matrix_selection_bits >> combo_id & 1)
+
+def resolve_generic_item(combo_id, chosen_bases):
+    # Final (Item No, Article No, base) entries for one matrix selection in the current market
+    return resolve_catalog_item(catalog, get_current_market_rule(), combo_id, chosen_bases)
+
+def update_resolved_items(combo_id):
+    # Called whenever a matrix selection or its chosen bases change, so Step 3 never re-resolves the whole selection.
+    # resolved_items_by_combo keeps selection order, which is the order of Step 3 and the export.
+    if not is_combo_selected(combo_id):
+        st.session_state.resolved_items_by_combo.pop(combo_id, None)
+    else:
+        st.session_state.resolved_items_by_combo[combo_id] = resolve_generic_item(combo_id, st.session_state.user_chosen_base_colors_for_items.get(combo_id, []))
+
+def set_combo_selected(combo_id, select):
+    if is_combo_selected(combo_id) == select: return False
+    st.session_state.matrix_selection_bits ^= 1 << combo_id
+    if not select: st.session_state.user_chosen_base_colors_for_items.pop(combo_id, None)
+    update_resolved_items(combo_id)
+    return True
+
+def sync_selection_with_catalog():
+    # Combo IDs are positions in one catalog build. After a reload (source file changed) the selection is carried over
+    # by combination key; combinations and bases that no longer exist are dropped.
+    if st.session_state.selection_catalog_signatures == catalog['signatures']: return
+    previous_combo_keys = st.session_state.selection_combo_keys
+    st.session_state.selection_catalog_signatures = catalog['signatures']
+    st.session_state.selection_combo_keys = catalog['combo_keys']
+    if not st.session_state.resolved_items_by_combo: return
+    market_rule = get_current_market_rule()
+    old_combo_keys, new_combo_ids = previous_combo_keys.get(market_rule, []), catalog['combo_ids'].get(market_rule, {})
+    selection_bits, chosen_bases, resolved_items, dropped_count = 0, {}, {}, 0
+    for old_combo_id in st.session_state.resolved_items_by_combo:
+        combo_key = old_combo_keys[old_combo_id] if old_combo_id < len(old_combo_keys) else None
+        combo_id = new_combo_ids.get(combo_key)
+        if combo_id is None:
+            dropped_count += 1; continue
+        available_bases = catalog['availability_index'][market_rule][combo_key]['base_colors']
+        bases_for_combo = [bc for bc in st.session_state.user_chosen_base_colors_for_items.get(old_combo_id, []) if bc in available_bases]
+        selection_bits |= 1 << combo_id
+        if bases_for_combo: chosen_bases[combo_id] = bases_for_combo
+        resolved_items[combo_id] = resolve_generic_item(combo_id, bases_for_combo)
+    st.session_state.matrix_selection_bits = selection_bits
+    st.session_state.user_chosen_base_colors_for_items = chosen_bases
+    st.session_state.resolved_items_by_combo = resolved_items
+    st.session_state.matrix_grid_version += 1
+    if dropped_count: st.toast(f"Product data was updated. {dropped_count} selection(s) no longer available were removed.", icon="⚠️")
+
+# --- Bulk Selection API ---
+def find_bulk_combos(market_rule, family=None, uph_type=None, prod_name=None, uph_color=None, filter_expr=None):
+    return find_combos(catalog, market_rule, family=family, uph_type=uph_type, prod_name=prod_name, uph_color=uph_color, filter_expr=filter_expr)
+
+def apply_bulk_selection(combo_ids, select):
+    # Applies a whole set of combo IDs and commits it as one state update
+    selection_bits = st.session_state.matrix_selection_bits
+    chosen_bases = dict(st.session_state.user_chosen_base_colors_for_items)
+    resolved_items = dict(st.session_state.resolved_items_by_combo)
+    changed_count = 0
+    for combo_id in combo_ids:
+        if bool(selection_bits >> combo_id & 1) == select: continue
+        selection_bits ^= 1 << combo_id
+        if select:
+            resolved_items[combo_id] = resolve_generic_item(combo_id, [])
+        else:
+            chosen_bases.pop(combo_id, None)
+            resolved_items.pop(combo_id, None)
+        changed_count += 1
+    st.session_state.matrix_selection_bits = selection_bits
+    st.session_state.user_chosen_base_colors_for_items = chosen_bases
+    st.session_state.resolved_items_by_combo = resolved_items
+    return changed_count
+
+# --- Swatch Sprite Header ---
+SWATCH_DISPLAY_SIZE = 30
+SWATCH_ZOOM_SIZE = 180
+
+def render_swatch_sprite_header(sprite_url, data_column_map):
+    # The family's swatch row as one sprite, referenced by its static URL so reruns only resend the markup:
+    # each column slot shows its sprite cell and links to a CSS zoom overlay
+    sprite_class = f"swatch-sprite-{os.path.splitext(os.path.basename(sprite_url))[0][:12]}"
+    num_swatches = len(data_column_map)
+    def sprite_cell(pos, size, css_class):
+        return f"<span class='{css_class} {sprite_class}' style='width:{size}px; height:{size}px; background-size:{num_swatches * size}px {size}px; background-position:-{pos * size}px 0'></span>"
+    slots_html, zooms_html = [], []
+    for pos, map_entry in enumerate(data_column_map):
+        swatch_label = html.escape(f"{map_entry['uph_type']} {map_entry['uph_color']}")
+        if map_entry['swatch'] and pd.notna(map_entry['swatch']):
+            slots_html.append(f"<a class='swatch-sprite-slot' href='#{sprite_class}-zoom-{pos}' title='{swatch_label}'>{sprite_cell(pos, SWATCH_DISPLAY_SIZE, 'swatch-sprite-cell')}</a>")
+            zooms_html.append(f"<div id='{sprite_class}-zoom-{pos}' class='swatch-zoom'><a class='swatch-zoom-close' href='#_'>{sprite_cell(pos, SWATCH_ZOOM_SIZE, 'swatch-zoom-cell')}<small>{swatch_label}</small></a></div>")
+        else:
+            slots_html.append("<span class='swatch-sprite-slot'><span class='swatch-placeholder'></span></span>")
+    st.markdown(f"<style>.{sprite_class} {{ background-image: url('{sprite_url}'); }}</style><div class='swatch-sprite-row'>{''.join(slots_html)}</div>{''.join(zooms_html)}", unsafe_allow_html=True)
 
 # --- Main Application Area ---
 if files_loaded_successfully:
+    sync_selection_with_catalog()
 
     # --- Step 1: Select Currency ---
     st.header("Step 1: Select currency")
     
     europe_currencies = []
     gbp_ie_currencies = []
-    EXPECTED_EUROPE_CURRENCIES = ['DACH - EURO', 'DKK', 'EURO', 'NOK', 'PLN', 'SEK', 'AUD']
-    EXPECTED_GBP_IE_CURRENCIES = ['GBP', 'IE - EUR'] 
 
     try:
-        if st.session_state.wholesale_prices_df is not None and not st.session_state.wholesale_prices_df.empty:
-            article_no_col_name_ws_eu = st.session_state.wholesale_prices_df.columns[0]
-            europe_currencies = [col for col in st.session_state.wholesale_prices_df.columns if col in EXPECTED_EUROPE_CURRENCIES and str(col).lower() != str(article_no_col_name_ws_eu).lower()]
+        if MARKET_RULE_EUROPE in catalog['price_index']:
+            europe_currencies = catalog['price_index'][MARKET_RULE_EUROPE]['wholesale'].columns.tolist()
         
-        if st.session_state.wholesale_prices_gbp_ie_df is not None and not st.session_state.wholesale_prices_gbp_ie_df.empty:
-            article_no_col_name_ws_gbp = st.session_state.wholesale_prices_gbp_ie_df.columns[0]
-            gbp_ie_currencies = [col for col in st.session_state.wholesale_prices_gbp_ie_df.columns if col in EXPECTED_GBP_IE_CURRENCIES and str(col).lower() != str(article_no_col_name_ws_gbp).lower()]
+        if MARKET_RULE_GBP_IE in catalog['price_index']:
+            gbp_ie_currencies = catalog['price_index'][MARKET_RULE_GBP_IE]['wholesale'].columns.tolist()
 
         currency_options = [DEFAULT_NO_SELECTION] + sorted(list(set(europe_currencies + gbp_ie_currencies)))
         
@@ -166,24 +251,19 @@ if files_loaded_successfully:
             st.session_state.selected_currency_session = None
 
         if st.session_state.selected_currency_session != prev_selected_currency:
-            st.session_state.matrix_selected_generic_items = {}
+            st.session_state.matrix_selection_bits = 0
             st.session_state.user_chosen_base_colors_for_items = {}
+            st.session_state.resolved_items_by_combo = {}
             st.session_state.final_items_for_download = []
             st.session_state.selected_family_session = DEFAULT_NO_SELECTION
             if prev_selected_currency is not None : st.toast(f"Currency changed. Product selections reset.", icon="⚠️")
 
 
-        if st.session_state.selected_currency_session and st.session_state.raw_df is not None:
-            current_currency = st.session_state.selected_currency_session
-            temp_df = st.session_state.raw_df.copy()
-            if current_currency in EXPECTED_GBP_IE_CURRENCIES:
-                st.session_state.filtered_raw_df = temp_df[temp_df['Market'] != 'EU']
-            elif current_currency in EXPECTED_EUROPE_CURRENCIES:
-                st.session_state.filtered_raw_df = temp_df[temp_df['Market'] != 'UK']
-            else:
-                 st.session_state.filtered_raw_df = pd.DataFrame(columns=st.session_state.raw_df.columns)
-        elif st.session_state.raw_df is not None:
-            st.session_state.filtered_raw_df = pd.DataFrame(columns=st.session_state.raw_df.columns)
+        # Sessions reference the shared, pre-partitioned market view for the currency (no per-rerun copies)
+        if st.session_state.selected_currency_session and catalog['raw_df'] is not None:
+            st.session_state.filtered_raw_df = catalog['market_views'].get(get_market_rule(st.session_state.selected_currency_session), catalog['empty_view'])
+        elif catalog['raw_df'] is not None:
+            st.session_state.filtered_raw_df = catalog['empty_view']
         else: 
             st.session_state.filtered_raw_df = pd.DataFrame()
     except Exception as e:
@@ -191,455 +271,389 @@ if files_loaded_successfully:
         st.session_state.selected_currency_session = None
         st.session_state.filtered_raw_df = pd.DataFrame()
 
-    # --- Step 2: Select product combinations ---
-    st.header("Step 2: Select product combinations (product / upholstery / color)")
+    # --- Steps 2-4 are nested fragments: an interaction reruns its own step plus the steps below it that
+    # depend on its selection state (2 -> 2a -> 3 -> 4), not the data-load guards or Step 1. ---
+    @st.fragment
+    def render_step_2_selection_matrix():
+        # --- Step 2: Select product combinations ---
+        show_pending_toasts()
+        st.header("Step 2: Select product combinations (product / upholstery / color)")
+
+        if not st.session_state.selected_currency_session:
+            st.info("Please select a currency in Step 1 to see available products.")
+        elif st.session_state.filtered_raw_df is None or st.session_state.filtered_raw_df.empty:
+            st.info(f"No products available for {st.session_state.selected_currency_session} based on market rules.")
+        else:
+            market_rule = get_market_rule(st.session_state.selected_currency_session)
+            combo_ids = catalog['combo_ids'].get(market_rule, {})
+            family_layouts = catalog['family_layouts'].get(market_rule, {})
+            available_families_in_view = [DEFAULT_NO_SELECTION] + list(family_layouts)
+        
+            if st.session_state.selected_family_session not in available_families_in_view:
+                st.session_state.selected_family_session = DEFAULT_NO_SELECTION
 
-    if not st.session_state.selected_currency_session:
-        st.info("Please select a currency in Step 1 to see available products.")
-    elif st.session_state.filtered_raw_df is None or st.session_state.filtered_raw_df.empty:
-        st.info(f"No products available for {st.session_state.selected_currency_session} based on market rules.")
-    else:
-        df_for_display = st.session_state.filtered_raw_df
+            selected_family_idx = 0
+            if st.session_state.selected_family_session in available_families_in_view:
+                selected_family_idx = available_families_in_view.index(st.session_state.selected_family_session)
 
-        available_families_in_view = [DEFAULT_NO_SELECTION] + sorted(df_for_display['Product Family'].dropna().unique()) if 'Product Family' in df_for_display.columns else [DEFAULT_NO_SELECTION]
-        
-        if st.session_state.selected_family_session not in available_families_in_view:
-            st.session_state.selected_family_session = DEFAULT_NO_SELECTION
+            selected_family = st.selectbox("Select Product Family:", options=available_families_in_view, index=selected_family_idx, key="family_selector_main")
+            st.session_state.selected_family_session = selected_family
+            st.toggle("Compact grid view", key="matrix_grid_mode", help="Show the matrix as a single grid. Recommended for large families.")
 
-        selected_family_idx = 0
-        if st.session_state.selected_family_session in available_families_in_view:
-            selected_family_idx = available_families_in_view.index(st.session_state.selected_family_session)
-
-        selected_family = st.selectbox("Select Product Family:", options=available_families_in_view, index=selected_family_idx, key="family_selector_main")
-        st.session_state.selected_family_session = selected_family
-
-        # --- Callback for individual checkbox toggle ---
-        def handle_matrix_cb_toggle(prod_name, uph_type, uph_color, checkbox_key_matrix):
-            is_checked = st.session_state[checkbox_key_matrix]
-            current_selected_family_for_key = st.session_state.selected_family_session 
-            generic_item_key = f"{current_selected_family_for_key}_{prod_name}_{uph_type}_{uph_color}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
-
-            if is_checked:
-                matching_items = st.session_state.filtered_raw_df[
-                    (st.session_state.filtered_raw_df['Product Family'] == current_selected_family_for_key) &
-                    (st.session_state.filtered_raw_df['Product Display Name'] == prod_name) &
-                    (st.session_state.filtered_raw_df['Upholstery Type'].fillna("N/A") == uph_type) &
-                    (st.session_state.filtered_raw_df['Upholstery Color'].astype(str).fillna("N/A") == uph_color)
-                ]
-                if not matching_items.empty:
-                    unique_base_colors = matching_items['Base Color Cleaned'].dropna().unique().tolist()
-                    first_item_match = matching_items.iloc[0]
-                    item_data = {
-                        'key': generic_item_key, 'family': current_selected_family_for_key, 'product': prod_name,
-                        'upholstery_type': uph_type, 'upholstery_color': uph_color,
-                        'requires_base_choice': len(unique_base_colors) > 1,
-                        'available_bases': unique_base_colors if len(unique_base_colors) > 1 else [],
-                        'item_no_if_single_base': first_item_match['Item No'] if len(unique_base_colors) <= 1 else None,
-                        'article_no_if_single_base': first_item_match['Article No'] if len(unique_base_colors) <= 1 else None,
-                        'resolved_base_if_single': unique_base_colors[0] if len(unique_base_colors) == 1 else (pd.NA if not unique_base_colors else None)
-                    }
-                    st.session_state.matrix_selected_generic_items[generic_item_key] = item_data
-            else: 
-                if generic_item_key in st.session_state.matrix_selected_generic_items:
-                    del st.session_state.matrix_selected_generic_items[generic_item_key]
-                    if generic_item_key in st.session_state.user_chosen_base_colors_for_items:
-                        del st.session_state.user_chosen_base_colors_for_items[generic_item_key]
-
-        # --- Callback for "Select All" column checkbox ---
-        def handle_select_all_column_toggle(uph_type_col, uph_color_col, products_in_col, select_all_key):
-            is_all_selected_for_column_now = st.session_state[select_all_key]
-            current_selected_family_for_key = st.session_state.selected_family_session
-
-            for prod_name in products_in_col:
-                item_exists_df_col = st.session_state.filtered_raw_df[
-                    (st.session_state.filtered_raw_df['Product Family'] == current_selected_family_for_key) &
-                    (st.session_state.filtered_raw_df['Product Display Name'] == prod_name) &
-                    (st.session_state.filtered_raw_df['Upholstery Type'].fillna("N/A") == uph_type_col) &
-                    (st.session_state.filtered_raw_df['Upholstery Color'].astype(str).fillna("N/A") == uph_color_col)
-                ]
-                if not item_exists_df_col.empty:
-                    generic_item_key_col = f"{current_selected_family_for_key}_{prod_name}_{uph_type_col}_{uph_color_col}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
-                    
-                    if is_all_selected_for_column_now: 
-                        if generic_item_key_col not in st.session_state.matrix_selected_generic_items:
-                            unique_base_colors_col = item_exists_df_col['Base Color Cleaned'].dropna().unique().tolist()
-                            first_item_match_col = item_exists_df_col.iloc[0]
-                            item_data_col = {
-                                'key': generic_item_key_col, 'family': current_selected_family_for_key, 'product': prod_name,
-                                'upholstery_type': uph_type_col, 'upholstery_color': uph_color_col,
-                                'requires_base_choice': len(unique_base_colors_col) > 1,
-                                'available_bases': unique_base_colors_col if len(unique_base_colors_col) > 1 else [],
-                                'item_no_if_single_base': first_item_match_col['Item No'] if len(unique_base_colors_col) <= 1 else None,
-                                'article_no_if_single_base': first_item_match_col['Article No'] if len(unique_base_colors_col) <= 1 else None,
-                                'resolved_base_if_single': unique_base_colors_col[0] if len(unique_base_colors_col) == 1 else (pd.NA if not unique_base_colors_col else None)
-                            }
-                            st.session_state.matrix_selected_generic_items[generic_item_key_col] = item_data_col
-                    else: 
-                        if generic_item_key_col in st.session_state.matrix_selected_generic_items:
-                            del st.session_state.matrix_selected_generic_items[generic_item_key_col]
-                            if generic_item_key_col in st.session_state.user_chosen_base_colors_for_items:
-                                del st.session_state.user_chosen_base_colors_for_items[generic_item_key_col]
+            # --- Callback for individual checkbox toggle ---
+            def handle_matrix_cb_toggle(combo_id, checkbox_key_matrix):
+                set_combo_selected(combo_id, st.session_state[checkbox_key_matrix])
+
+            # --- Callback for "Select All" column checkbox ---
+            def handle_select_all_column_toggle(uph_type_col, uph_color_col, column_mask, select_all_key):
+                is_all_selected_for_column_now = st.session_state[select_all_key]
+                apply_bulk_selection(iter_mask_combo_ids(column_mask), is_all_selected_for_column_now)
             
-            action = "selected" if is_all_selected_for_column_now else "deselected"
-            st.toast(f"All available items in column '{uph_type_col} - {uph_color_col}' {action}.", icon="✅" if is_all_selected_for_column_now else "❌")
+                action = "selected" if is_all_selected_for_column_now else "deselected"
+                queue_toast(f"All available items in column '{uph_type_col} - {uph_color_col}' {action}.", "✅" if is_all_selected_for_column_now else "❌")
+
+            # --- Callback for the compact grid: applies only the changed cells ---
+            def handle_matrix_grid_change(family, products_in_grid, grid_column_map, grid_column_masks, grid_key):
+                # Row 0 is the "Select All" row; grid columns are "c<i>" positions into grid_column_map
+                edited_rows = st.session_state[grid_key].get('edited_rows', {})
+                for row_pos, changed_cells in edited_rows.items():
+                    for grid_col_id, is_checked in changed_cells.items():
+                        if not grid_col_id.startswith("c"): continue
+                        col_entry = grid_column_map[int(grid_col_id[1:])]
+                        if int(row_pos) == 0:
+                            apply_bulk_selection(iter_mask_combo_ids(grid_column_masks[int(grid_col_id[1:])]), is_checked)
+                        else:
+                            combo_id = combo_ids.get((family, products_in_grid[int(row_pos) - 1], col_entry['uph_type'], col_entry['uph_color']))
+                            if combo_id is not None: set_combo_selected(combo_id, is_checked)
+                # A fresh widget key lets the next render start from the updated selection instead of replaying the diff
+                st.session_state.matrix_grid_version += 1
+
+            # --- Callback for the bulk selection buttons (family / upholstery type / product / filter expression) ---
+            def handle_bulk_selection(family, select):
+                bulk_uph_type = st.session_state.bulk_uph_type_select
+                bulk_product = st.session_state.bulk_product_select
+                bulk_filter_expr = st.session_state.bulk_filter_expr_input.strip()
+                try:
+                    bulk_combos = find_bulk_combos(market_rule, family=family,
+                                                   uph_type=None if bulk_uph_type == BULK_ALL_OPTION else bulk_uph_type,
+                                                   prod_name=None if bulk_product == BULK_ALL_OPTION else bulk_product,
+                                                   filter_expr=bulk_filter_expr or None)
+                except Exception as e:
+                    queue_toast(f"Invalid filter expression: {e}", "⚠️"); return
+                changed_count = apply_bulk_selection(bulk_combos, select)
+                queue_toast(f"{changed_count} combination(s) {'selected' if select else 'deselected'} in {family}.", "✅" if select else "❌")
+
+            if selected_family and selected_family != DEFAULT_NO_SELECTION:
+                family_layout = family_layouts.get(selected_family)
+                if family_layout:
+                    products_in_family = family_layout['products']
+                    upholstery_types_in_family = family_layout['upholstery_types']
+
+                    if not products_in_family: st.info(f"No products in {selected_family} for current currency/market.")
+                    elif not upholstery_types_in_family: st.info(f"No upholstery types for {selected_family} for current currency/market.")
+                    else:
+                        data_column_map = family_layout['data_column_map']
+                        column_masks = family_layout['column_masks']
+                        selection_bits = st.session_state.matrix_selection_bits
+
+                        with st.expander("Bulk selection"):
+                            bulk_filter_cols = st.columns(3)
+                            bulk_filter_cols[0].selectbox("Upholstery type:", options=[BULK_ALL_OPTION] + list(upholstery_types_in_family), key="bulk_uph_type_select")
+                            bulk_filter_cols[1].selectbox("Product:", options=[BULK_ALL_OPTION] + list(products_in_family), key="bulk_product_select")
+                            bulk_filter_cols[2].text_input("Filter expression (optional):", key="bulk_filter_expr_input", placeholder="`Product Type` == 'Sofa' and `Upholstery Color` != '151'",
+                                                           help=f"Comparisons (==, !=, <, >, in [...]) joined by and / or / not, over: {', '.join(BULK_FILTER_COLS)}. Wrap column names in backticks.")
+                            bulk_button_cols = st.columns([1, 1, 4])
+                            bulk_button_cols[0].button("Select matching", key="bulk_select_button", on_click=handle_bulk_selection, args=(selected_family, True))
+                            bulk_button_cols[1].button("Deselect matching", key="bulk_deselect_button", on_click=handle_bulk_selection, args=(selected_family, False))
+
+                        num_data_columns = len(data_column_map)
+                        if num_data_columns > 0 and st.session_state.matrix_grid_mode:
+                            # --- Compact grid: the whole matrix as one data_editor widget; unavailable cells are empty ---
+                            grid_col_ids = [f"c{i}" for i in range(num_data_columns)]
+                            grid_rows = [["Select All"] + [is_mask_selected(selection_bits, column_mask) if column_mask else None for column_mask in column_masks]]
+                            for prod_name_g in products_in_family:
+                                grid_combo_ids = [combo_ids.get((selected_family, prod_name_g, col_entry['uph_type'], col_entry['uph_color'])) for col_entry in data_column_map]
+                                grid_rows.append([prod_name_g] + [is_combo_selected(combo_id) if combo_id is not None else None for combo_id in grid_combo_ids])
+                            grid_column_config = {"Product": st.column_config.TextColumn("Product", disabled=True)}
+                            for grid_col_id, col_entry in zip(grid_col_ids, data_column_map):
+                                grid_column_config[grid_col_id] = st.column_config.CheckboxColumn(f"{col_entry['uph_type']} {col_entry['uph_color']}", help=f"{col_entry['uph_type']} - {col_entry['uph_color']}")
+                            grid_key = f"matrix_grid_{selected_family}_{st.session_state.matrix_grid_version}".replace(" ","_").replace("/","_").replace("(","").replace(")","")
+                            st.data_editor(pd.DataFrame(grid_rows, columns=["Product"] + grid_col_ids, dtype=object), key=grid_key, hide_index=True,
+                                           column_config=grid_column_config, num_rows="fixed",
+                                           on_change=handle_matrix_grid_change, args=(selected_family, products_in_family, data_column_map, column_masks, grid_key))
+                        elif num_data_columns > 0:
+                            cols_uph_type_header = st.columns([2.5] + [1] * num_data_columns)
+                            current_uph_type_header_display = None
+                            for i, col_widget in enumerate(cols_uph_type_header):
+                                if i > 0:
+                                    map_entry = data_column_map[i-1] 
+                                    if map_entry['uph_type'] != current_uph_type_header_display: 
+                                        with col_widget: st.caption(f"<div class='upholstery-header'>{map_entry['uph_type']}</div>", unsafe_allow_html=True)
+                                        current_uph_type_header_display = map_entry['uph_type']
+
+                            # Swatches are served as locally cached thumbnails: one sprite per family when every swatch is cached,
+                            # otherwise one image per column, showing the remote URL until its thumbnail has been fetched in the background
+                            swatch_urls = [map_entry['swatch'] for map_entry in data_column_map]
+                            swatch_thumbnails = request_swatches(swatch_urls)
+                            swatch_sprite_url = get_swatch_sprite_url(swatch_urls)
+                            if swatch_sprite_url:
+                                cols_swatch_header = st.columns([2.5, num_data_columns])
+                                cols_swatch_header[0].markdown("<div class='zoom-instruction'><br>Click swatch to zoom</div>", unsafe_allow_html=True)
+                                with cols_swatch_header[1]: render_swatch_sprite_header(swatch_sprite_url, data_column_map)
+                            else:
+                                cols_swatch_header = st.columns([2.5] + [1] * num_data_columns)
+                                cols_swatch_header[0].markdown("<div class='zoom-instruction'><br>Click swatch to zoom</div>", unsafe_allow_html=True)
+                                for i, col_widget in enumerate(cols_swatch_header[1:]): 
+                                    sw_url = data_column_map[i]['swatch'] 
+                                    with col_widget:
+                                        if sw_url and pd.notna(sw_url): st.image(swatch_thumbnails.get(sw_url) or sw_url, width=30)
+                                        else: st.markdown("<div class='swatch-placeholder'></div>", unsafe_allow_html=True)
+
+                            cols_color_num_header = st.columns([2.5] + [1] * num_data_columns)
+                            for i, col_widget in enumerate(cols_color_num_header):
+                                if i > 0: 
+                                    with col_widget: st.caption(f"<small>{data_column_map[i-1]['uph_color']}</small>", unsafe_allow_html=True)
+                        
+                            # --- "Select All" Checkbox Row for Upholstery Columns ---
+                            cols_select_all_header = st.columns([2.5] + [1] * num_data_columns, vertical_alignment="center") 
+                            cols_select_all_header[0].markdown("<div class='select-all-label'>Select All:</div>", unsafe_allow_html=True) 
+                            for i, col_widget_sa in enumerate(cols_select_all_header[1:]):
+                                current_col_map_entry = data_column_map[i]
+                                uph_type_for_col_sa = current_col_map_entry['uph_type']
+                                uph_color_for_col_sa = current_col_map_entry['uph_color']
+                                column_mask = column_masks[i]
+                                all_in_col_selected = is_mask_selected(selection_bits, column_mask)
+
+                                select_all_key = f"select_all_cb_{selected_family}_{uph_type_for_col_sa}_{uph_color_for_col_sa}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
+                            
+                                with col_widget_sa:
+                                    if column_mask: 
+                                        st.checkbox(" ", value=all_in_col_selected, key=select_all_key, 
+                                                    on_change=handle_select_all_column_toggle, 
+                                                    args=(uph_type_for_col_sa, uph_color_for_col_sa, column_mask, select_all_key),
+                                                    label_visibility="collapsed",
+                                                    help=f"Select/Deselect all for {uph_type_for_col_sa} - {uph_color_for_col_sa}")
+                                    else: st.markdown("<div class='checkbox-placeholder'></div>", unsafe_allow_html=True)
+
+                            st.markdown("---") 
+
+                            for prod_name in products_in_family:
+                                cols_product_row = st.columns([2.5] + [1] * num_data_columns, vertical_alignment="center")
+                                cols_product_row[0].markdown(f"<div class='product-name-cell'>{prod_name}</div>", unsafe_allow_html=True)
+
+                                for i, col_widget in enumerate(cols_product_row[1:]): 
+                                    current_col_uph_type_filter = data_column_map[i]['uph_type']
+                                    current_col_uph_color_filter = data_column_map[i]['uph_color']
+                                    cell_container = col_widget.container() 
+                                    combo_id_cell = combo_ids.get((selected_family, prod_name, current_col_uph_type_filter, current_col_uph_color_filter))
+                                    if combo_id_cell is not None:
+                                        cb_key_str = f"cb_{selected_family}_{prod_name}_{current_col_uph_type_filter}_{current_col_uph_color_filter}".replace(" ","_").replace("/","_").replace("(","").replace(")","")
+                                        cell_container.checkbox(" ", value=is_combo_selected(combo_id_cell), key=cb_key_str, 
+                                                                on_change=handle_matrix_cb_toggle, 
+                                                                args=(combo_id_cell, cb_key_str), 
+                                                                label_visibility="collapsed")
+                else: 
+                     if selected_family and selected_family != DEFAULT_NO_SELECTION : st.info(f"No data for {selected_family} with current currency/market.")
+            else: 
+                if selected_family and selected_family != DEFAULT_NO_SELECTION : st.info(f"Select product family.")
 
+        render_step_2a_base_colors()
+
+    @st.fragment
+    def render_step_2a_base_colors():
         # --- Callback for individual item's base color multiselect ---
-        def handle_base_color_multiselect_change(item_key_for_base_select):
-            multiselect_widget_key = f"ms_base_{item_key_for_base_select}"
-            st.session_state.user_chosen_base_colors_for_items[item_key_for_base_select] = st.session_state[multiselect_widget_key]
+        def handle_base_color_multiselect_change(combo_id_for_base_select, multiselect_widget_key):
+            st.session_state.user_chosen_base_colors_for_items[combo_id_for_base_select] = st.session_state[multiselect_widget_key]
+            update_resolved_items(combo_id_for_base_select)
 
         # --- Callback for family-level "Select All [Base Color X] for this family" ---
         def handle_family_base_color_select_all_toggle(family_name_cb, base_color_cb, items_in_family_cb, checkbox_key_cb):
             is_checked = st.session_state[checkbox_key_cb]
             action_count = 0
             for item_data_cb in items_in_family_cb:
-                item_key_cb = item_data_cb['key']
+                item_key_cb = item_data_cb['combo_id']
                 # Ensure this item *can* have this base color
                 if base_color_cb in item_data_cb['available_bases']:
                     current_bases_for_item = st.session_state.user_chosen_base_colors_for_items.get(item_key_cb, [])
                     if is_checked: # Add this base color
                         if base_color_cb not in current_bases_for_item:
                             st.session_state.user_chosen_base_colors_for_items[item_key_cb] = current_bases_for_item + [base_color_cb]
+                            update_resolved_items(item_key_cb)
                             action_count += 1
                     else: # Remove this base color
                         if base_color_cb in current_bases_for_item:
                             new_bases = [b for b in current_bases_for_item if b != base_color_cb]
                             st.session_state.user_chosen_base_colors_for_items[item_key_cb] = new_bases
+                            update_resolved_items(item_key_cb)
                             action_count += 1
             
             if action_count > 0:
                 action_desc = "applied to" if is_checked else "removed from"
-                st.toast(f"Base color '{base_color_cb}' {action_desc} {action_count} applicable product(s) in {family_name_cb}.", icon="✅" if is_checked else "❌")
-
-
-        if selected_family and selected_family != DEFAULT_NO_SELECTION and 'Product Family' in df_for_display.columns:
-            family_df = df_for_display[df_for_display['Product Family'] == selected_family]
-            if not family_df.empty and 'Upholstery Type' in family_df.columns:
-                products_in_family = sorted(family_df['Product Display Name'].dropna().unique())
-                upholstery_types_in_family = sorted(family_df['Upholstery Type'].dropna().unique())
-
-                if not products_in_family: st.info(f"No products in {selected_family} for current currency/market.")
-                elif not upholstery_types_in_family: st.info(f"No upholstery types for {selected_family} for current currency/market.")
-                else:
-                    header_upholstery_types, header_swatches, header_color_numbers, data_column_map = [], [], [], []
-                    header_upholstery_types.append("Product") 
-                    header_swatches.append(" ") 
-                    header_color_numbers.append(" ") 
-
-                    for uph_type_clean in upholstery_types_in_family:
-                        colors_for_type_df = family_df[family_df['Upholstery Type'] == uph_type_clean][['Upholstery Color', 'Image URL swatch']].drop_duplicates().sort_values(by='Upholstery Color')
-                        if not colors_for_type_df.empty:
-                            header_upholstery_types.extend([uph_type_clean] + [""] * (len(colors_for_type_df) -1) ) 
-                            for _, color_row in colors_for_type_df.iterrows():
-                                color_val, swatch_val = str(color_row['Upholstery Color']), color_row['Image URL swatch']
-                                header_swatches.append(swatch_val if pd.notna(swatch_val) else None)
-                                header_color_numbers.append(color_val)
-                                data_column_map.append({'uph_type': uph_type_clean, 'uph_color': color_val, 'swatch': swatch_val})
-                    
-                    num_data_columns = len(data_column_map)
-                    if num_data_columns > 0:
-                        cols_uph_type_header = st.columns([2.5] + [1] * num_data_columns)
-                        current_uph_type_header_display = None
-                        for i, col_widget in enumerate(cols_uph_type_header):
-                            if i > 0:
-                                map_entry = data_column_map[i-1] 
-                                if map_entry['uph_type'] != current_uph_type_header_display: 
-                                    with col_widget: st.caption(f"<div class='upholstery-header'>{map_entry['uph_type']}</div>", unsafe_allow_html=True)
-                                    current_uph_type_header_display = map_entry['uph_type']
-
-                        cols_swatch_header = st.columns([2.5] + [1] * num_data_columns)
-                        cols_swatch_header[0].markdown("<div class='zoom-instruction'><br>Click swatch to zoom</div>", unsafe_allow_html=True)
-                        for i, col_widget in enumerate(cols_swatch_header[1:]): 
-                            sw_url = data_column_map[i]['swatch'] 
-                            with col_widget:
-                                if sw_url and pd.notna(sw_url): st.image(sw_url, width=30)
-                                else: st.markdown("<div class='swatch-placeholder'></div>", unsafe_allow_html=True)
-
-                        cols_color_num_header = st.columns([2.5] + [1] * num_data_columns)
-                        for i, col_widget in enumerate(cols_color_num_header):
-                            if i > 0: 
-                                with col_widget: st.caption(f"<small>{data_column_map[i-1]['uph_color']}</small>", unsafe_allow_html=True)
-                        
-                        # --- "Select All" Checkbox Row for Upholstery Columns ---
-                        cols_select_all_header = st.columns([2.5] + [1] * num_data_columns, vertical_alignment="center") 
-                        cols_select_all_header[0].markdown("<div class='select-all-label'>Select All:</div>", unsafe_allow_html=True) 
-                        for i, col_widget_sa in enumerate(cols_select_all_header[1:]):
-                            current_col_map_entry = data_column_map[i]
-                            uph_type_for_col_sa = current_col_map_entry['uph_type']
-                            uph_color_for_col_sa = current_col_map_entry['uph_color']
-                            
-                            all_in_col_selected = True
-                            num_selectable_in_col = 0
-                            for prod_name_sa in products_in_family:
-                                item_exists_df_sa = family_df[
-                                    (family_df['Product Display Name'] == prod_name_sa) &
-                                    (family_df['Upholstery Type'] == uph_type_for_col_sa) &
-                                    (family_df['Upholstery Color'].astype(str).fillna("N/A") == uph_color_for_col_sa)
-                                ]
-                                if not item_exists_df_sa.empty:
-                                    num_selectable_in_col += 1
-                                    generic_item_key_sa = f"{selected_family}_{prod_name_sa}_{uph_type_for_col_sa}_{uph_color_for_col_sa}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
-                                    if generic_item_key_sa not in st.session_state.matrix_selected_generic_items:
-                                        all_in_col_selected = False; break
-                            if num_selectable_in_col == 0 : all_in_col_selected = False
-
-                            select_all_key = f"select_all_cb_{selected_family}_{uph_type_for_col_sa}_{uph_color_for_col_sa}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
-                            
-                            with col_widget_sa:
-                                if num_selectable_in_col > 0: 
-                                    st.checkbox(" ", value=all_in_col_selected, key=select_all_key, 
-                                                on_change=handle_select_all_column_toggle, 
-                                                args=(uph_type_for_col_sa, uph_color_for_col_sa, products_in_family, select_all_key),
-                                                label_visibility="collapsed",
-                                                help=f"Select/Deselect all for {uph_type_for_col_sa} - {uph_color_for_col_sa}")
-                                else: st.markdown("<div class='checkbox-placeholder'></div>", unsafe_allow_html=True)
-
-                        st.markdown("---") 
-
-                        for prod_name in products_in_family:
-                            cols_product_row = st.columns([2.5] + [1] * num_data_columns, vertical_alignment="center")
-                            cols_product_row[0].markdown(f"<div class='product-name-cell'>{prod_name}</div>", unsafe_allow_html=True)
-
-                            for i, col_widget in enumerate(cols_product_row[1:]): 
-                                current_col_uph_type_filter = data_column_map[i]['uph_type']
-                                current_col_uph_color_filter = data_column_map[i]['uph_color']
-                                item_exists_df = family_df[
-                                    (family_df['Product Display Name'] == prod_name) &
-                                    (family_df['Upholstery Type'] == current_col_uph_type_filter) &
-                                    (family_df['Upholstery Color'].astype(str).fillna("N/A") == current_col_uph_color_filter)
-                                ]
-                                cell_container = col_widget.container() 
-                                if not item_exists_df.empty:
-                                    cb_key_str = f"cb_{selected_family}_{prod_name}_{current_col_uph_type_filter}_{current_col_uph_color_filter}".replace(" ","_").replace("/","_").replace("(","").replace(")","")
-                                    generic_item_key_for_check = f"{selected_family}_{prod_name}_{current_col_uph_type_filter}_{current_col_uph_color_filter}".replace(" ", "_").replace("/","_").replace("(","").replace(")","")
-                                    is_gen_selected = generic_item_key_for_check in st.session_state.matrix_selected_generic_items
-                                    cell_container.checkbox(" ", value=is_gen_selected, key=cb_key_str, 
-                                                            on_change=handle_matrix_cb_toggle, 
-                                                            args=(prod_name, current_col_uph_type_filter, current_col_uph_color_filter, cb_key_str), 
-                                                            label_visibility="collapsed")
-            else: 
-                 if selected_family and selected_family != DEFAULT_NO_SELECTION : st.info(f"No data for {selected_family} with current currency/market.")
-        else: 
-            if selected_family and selected_family != DEFAULT_NO_SELECTION : st.info(f"Select product family.")
+                queue_toast(f"Base color '{base_color_cb}' {action_desc} {action_count} applicable product(s) in {family_name_cb}.", "✅" if is_checked else "❌")
 
-
-    # --- Step 2a: Specify Base Colors (Grouped by Family) ---
-    items_needing_base_choice_now = [item_data for item_data in st.session_state.matrix_selected_generic_items.values() if item_data.get('requires_base_choice')]
+        # --- Step 2a: Specify Base Colors (Grouped by Family) ---
+        show_pending_toasts()
+        market_rule_for_base_step = get_current_market_rule()
+        items_needing_base_choice_now = [item_data for item_data in (get_combo_item_data(catalog, market_rule_for_base_step, combo_id) for combo_id in st.session_state.resolved_items_by_combo)
+                                         if item_data.get('requires_base_choice')]
     
-    if items_needing_base_choice_now:
-        st.subheader("Step 2a: Specify base colors")
-
-        items_by_family_for_base_step = {}
-        for item_data in items_needing_base_choice_now:
-            family_name = item_data['family']
-            if family_name not in items_by_family_for_base_step:
-                items_by_family_for_base_step[family_name] = []
-            items_by_family_for_base_step[family_name].append(item_data)
-
-        if not items_by_family_for_base_step:
-            st.info("No selected items currently require base color specification.")
-        else:
-            for family_name_for_base, items_in_this_family_for_base in items_by_family_for_base_step.items(): 
-                st.markdown(f"#### {family_name_for_base}")
+        if items_needing_base_choice_now:
+            st.subheader("Step 2a: Specify base colors")
+
+            items_by_family_for_base_step = {}
+            for item_data in items_needing_base_choice_now:
+                family_name = item_data['family']
+                if family_name not in items_by_family_for_base_step:
+                    items_by_family_for_base_step[family_name] = []
+                items_by_family_for_base_step[family_name].append(item_data)
+
+            if not items_by_family_for_base_step:
+                st.info("No selected items currently require base color specification.")
+            else:
+                for family_name_for_base, items_in_this_family_for_base in items_by_family_for_base_step.items(): 
+                    st.markdown(f"#### {family_name_for_base}")
 
-                unique_bases_for_family_group = set()
-                for item_in_fam in items_in_this_family_for_base: 
-                    unique_bases_for_family_group.update(item_in_fam['available_bases'])
+                    unique_bases_for_family_group = set()
+                    for item_in_fam in items_in_this_family_for_base: 
+                        unique_bases_for_family_group.update(item_in_fam['available_bases'])
                 
-                sorted_unique_bases_for_family_group = sorted(list(unique_bases_for_family_group))
+                    sorted_unique_bases_for_family_group = sorted(list(unique_bases_for_family_group))
 
-                if not sorted_unique_bases_for_family_group:
-                    st.caption("No common base colors available or no items need base selection in this family.")
-                else:
-                    st.markdown("<small>Apply specific base color to all applicable products in this family:</small>", unsafe_allow_html=True)
+                    if not sorted_unique_bases_for_family_group:
+                        st.caption("No common base colors available or no items need base selection in this family.")
+                    else:
+                        st.markdown("<small>Apply specific base color to all applicable products in this family:</small>", unsafe_allow_html=True)
                     
-                    for base_color_option in sorted_unique_bases_for_family_group:
-                        family_base_cb_key = f"fam_base_all_{family_name_for_base}_{base_color_option}".replace(" ","_").replace("/","_").replace("(","").replace(")","")
+                        for base_color_option in sorted_unique_bases_for_family_group:
+                            family_base_cb_key = f"fam_base_all_{family_name_for_base}_{base_color_option}".replace(" ","_").replace("/","_").replace("(","").replace(")","")
                         
-                        is_this_base_selected_for_all_applicable_in_fam = True
-                        num_applicable_for_this_base = 0
-                        for item_in_fam_check in items_in_this_family_for_base: 
-                            if base_color_option in item_in_fam_check['available_bases']:
-                                num_applicable_for_this_base +=1
-                                chosen_bases_for_item = st.session_state.user_chosen_base_colors_for_items.get(item_in_fam_check['key'], [])
-                                if base_color_option not in chosen_bases_for_item:
-                                    is_this_base_selected_for_all_applicable_in_fam = False
-                                    break
-                        if num_applicable_for_this_base == 0: 
-                            is_this_base_selected_for_all_applicable_in_fam = False
-
-                        if num_applicable_for_this_base > 0: 
-                            st.checkbox(f"{base_color_option}", 
-                                        value=is_this_base_selected_for_all_applicable_in_fam, 
-                                        key=family_base_cb_key,
-                                        on_change=handle_family_base_color_select_all_toggle,
-                                        args=(family_name_for_base, base_color_option, items_in_this_family_for_base, family_base_cb_key)
-                                        )
-                    st.markdown("---") 
+                            is_this_base_selected_for_all_applicable_in_fam = True
+                            num_applicable_for_this_base = 0
+                            for item_in_fam_check in items_in_this_family_for_base: 
+                                if base_color_option in item_in_fam_check['available_bases']:
+                                    num_applicable_for_this_base +=1
+                                    chosen_bases_for_item = st.session_state.user_chosen_base_colors_for_items.get(item_in_fam_check['combo_id'], [])
+                                    if base_color_option not in chosen_bases_for_item:
+                                        is_this_base_selected_for_all_applicable_in_fam = False
+                                        break
+                            if num_applicable_for_this_base == 0: 
+                                is_this_base_selected_for_all_applicable_in_fam = False
+
+                            if num_applicable_for_this_base > 0: 
+                                st.checkbox(f"{base_color_option}", 
+                                            value=is_this_base_selected_for_all_applicable_in_fam, 
+                                            key=family_base_cb_key,
+                                            on_change=handle_family_base_color_select_all_toggle,
+                                            args=(family_name_for_base, base_color_option, items_in_this_family_for_base, family_base_cb_key)
+                                            )
+                        st.markdown("---") 
 
-                for generic_item in items_in_this_family_for_base: 
-                    item_key = generic_item['key']
-                    multiselect_key = f"ms_base_{item_key}"
+                    for generic_item in items_in_this_family_for_base: 
+                        combo_id = generic_item['combo_id']
+                        multiselect_key = f"ms_base_{generic_item['key']}"
                     
-                    st.markdown(f"**{generic_item['product']}** ({generic_item['upholstery_type']} - {generic_item['upholstery_color']})")
+                        st.markdown(f"**{generic_item['product']}** ({generic_item['upholstery_type']} - {generic_item['upholstery_color']})")
                     
-                    st.multiselect(
-                        label=f"Available base colors for this item:", 
-                        options=generic_item['available_bases'],
-                        default=st.session_state.user_chosen_base_colors_for_items.get(item_key, []),
-                        key=multiselect_key,
-                        on_change=handle_base_color_multiselect_change, 
-                        args=(item_key,)
-                    )
+                        st.multiselect(
+                            label=f"Available base colors for this item:", 
+                            options=generic_item['available_bases'],
+                            default=st.session_state.user_chosen_base_colors_for_items.get(combo_id, []),
+                            key=multiselect_key,
+                            on_change=handle_base_color_multiselect_change, 
+                            args=(combo_id, multiselect_key)
+                        )
+                        st.markdown("---") 
                     st.markdown("---") 
-                st.markdown("---") 
-    
-    # --- Step 3: Review Selections ---
-    st.header("Step 3: Review selections")
-    _current_final_items = [] 
-    
-    if st.session_state.filtered_raw_df is not None and not st.session_state.filtered_raw_df.empty:
-        for key, gen_item_data in st.session_state.matrix_selected_generic_items.items():
-            if not gen_item_data['requires_base_choice']: 
-                if gen_item_data.get('item_no_if_single_base') is not None: 
-                    _current_final_items.append({"description": f"{gen_item_data['family']} / {gen_item_data['product']} / {gen_item_data['upholstery_type']} / {gen_item_data['upholstery_color']}" + (f" / Base: {gen_item_data['resolved_base_if_single']}" if pd.notna(gen_item_data['resolved_base_if_single']) else ""), "item_no": gen_item_data['item_no_if_single_base'], "article_no": gen_item_data['article_no_if_single_base'], "key_in_matrix": key})
-            else: 
-                selected_bases_for_this = st.session_state.user_chosen_base_colors_for_items.get(key, [])
-                for bc in selected_bases_for_this:
-                    specific_item_df = st.session_state.filtered_raw_df[
-                        (st.session_state.filtered_raw_df['Product Family'] == gen_item_data['family']) &
-                        (st.session_state.filtered_raw_df['Product Display Name'] == gen_item_data['product']) &
-                        (st.session_state.filtered_raw_df['Upholstery Type'].fillna("N/A") == gen_item_data['upholstery_type']) &
-                        (st.session_state.filtered_raw_df['Upholstery Color'].astype(str).fillna("N/A") == gen_item_data['upholstery_color']) &
-                        (st.session_state.filtered_raw_df['Base Color Cleaned'].fillna("N/A") == bc)]
-                    if not specific_item_df.empty:
-                        actual_item = specific_item_df.iloc[0] 
-                        _current_final_items.append({"description": f"{gen_item_data['family']} / {gen_item_data['product']} / {gen_item_data['upholstery_type']} / {gen_item_data['upholstery_color']} / Base: {bc}", "item_no": actual_item['Item No'], "article_no": actual_item['Article No'], "key_in_matrix": key, "chosen_base": bc})
-    
-    temp_final_list_review, seen_item_keys_for_review = [], set() 
-    for item_rev in _current_final_items:
-        unique_config_key = f"{item_rev['item_no']}_{item_rev.get('chosen_base', 'NO_BASE_APPLICABLE')}"
-        if unique_config_key not in seen_item_keys_for_review:
-            temp_final_list_review.append(item_rev)
-            seen_item_keys_for_review.add(unique_config_key)
-    st.session_state.final_items_for_download = temp_final_list_review
-
-
-    if st.session_state.final_items_for_download:
-        st.markdown("**Current Selections for Download:**")
-        for i in range(len(st.session_state.final_items_for_download) -1, -1, -1):
-            combo = st.session_state.final_items_for_download[i]
-            col1_rev, col2_rev = st.columns([0.9, 0.1])
-            col1_rev.write(f"{i+1}. {combo['description']} (Item: {combo['item_no']})")
-            remove_button_key = f"final_review_remove_{i}_{combo['item_no']}_{combo.get('chosen_base','nobase')}"
-            if col2_rev.button(f"Remove", key=remove_button_key):
-                original_matrix_key = combo['key_in_matrix'] 
-                if original_matrix_key in st.session_state.matrix_selected_generic_items:
-                    generic_item_details = st.session_state.matrix_selected_generic_items[original_matrix_key]
-                    if generic_item_details.get('requires_base_choice') and 'chosen_base' in combo:
-                        chosen_base_to_remove = combo['chosen_base']
-                        if original_matrix_key in st.session_state.user_chosen_base_colors_for_items:
-                            if chosen_base_to_remove in st.session_state.user_chosen_base_colors_for_items[original_matrix_key]:
-                                st.session_state.user_chosen_base_colors_for_items[original_matrix_key].remove(chosen_base_to_remove)
-                                if not st.session_state.user_chosen_base_colors_for_items[original_matrix_key]:
-                                    del st.session_state.user_chosen_base_colors_for_items[original_matrix_key] 
-                                    if not st.session_state.user_chosen_base_colors_for_items.get(original_matrix_key): 
-                                         del st.session_state.matrix_selected_generic_items[original_matrix_key]
-                    else: 
-                        del st.session_state.matrix_selected_generic_items[original_matrix_key]
-                        if original_matrix_key in st.session_state.user_chosen_base_colors_for_items:
-                             del st.session_state.user_chosen_base_colors_for_items[original_matrix_key]
-                st.session_state.final_items_for_download.pop(i)
-                st.toast(f"Removed: {combo['description']}", icon="🗑️")
-                st.rerun() 
-        st.markdown("---")
-    else:
-        st.info("No items selected for download yet.")
-
 
-    # --- Step 4: Generate Master Data File ---
-    st.header("Step 4: Generate master data file")
+        render_step_3_review()
+
+    @st.fragment
+    def render_step_3_review():
+        # --- Step 3: Review Selections ---
+        st.header("Step 3: Review selections")
+        # Resolved items are maintained per combo ID by the selection callbacks; here they are only flattened
+        _current_final_items = [] 
+        if st.session_state.filtered_raw_df is not None and not st.session_state.filtered_raw_df.empty:
+            for resolved_items_for_key in st.session_state.resolved_items_by_combo.values():
+                _current_final_items.extend(resolved_items_for_key)
+    
+        st.session_state.final_items_for_download = dedupe_final_items(_current_final_items)
+
+
+        if st.session_state.final_items_for_download:
+            st.markdown("**Current Selections for Download:**")
+            for i in range(len(st.session_state.final_items_for_download) -1, -1, -1):
+                combo = st.session_state.final_items_for_download[i]
+                col1_rev, col2_rev = st.columns([0.9, 0.1])
+                col1_rev.write(f"{i+1}. {combo['description']} (Item: {combo['item_no']})")
+                remove_button_key = f"final_review_remove_{i}_{combo['item_no']}_{combo.get('chosen_base','nobase')}"
+                if col2_rev.button(f"Remove", key=remove_button_key):
+                    original_matrix_key = combo['combo_id'] 
+                    if is_combo_selected(original_matrix_key):
+                        if 'chosen_base' in combo:
+                            chosen_base_to_remove = combo['chosen_base']
+                            if original_matrix_key in st.session_state.user_chosen_base_colors_for_items:
+                                if chosen_base_to_remove in st.session_state.user_chosen_base_colors_for_items[original_matrix_key]:
+                                    st.session_state.user_chosen_base_colors_for_items[original_matrix_key].remove(chosen_base_to_remove)
+                                    if not st.session_state.user_chosen_base_colors_for_items[original_matrix_key]:
+                                        del st.session_state.user_chosen_base_colors_for_items[original_matrix_key] 
+                                        if not st.session_state.user_chosen_base_colors_for_items.get(original_matrix_key): 
+                                             set_combo_selected(original_matrix_key, False)
+                            update_resolved_items(original_matrix_key)
+                        else: 
+                            set_combo_selected(original_matrix_key, False)
+                    st.session_state.final_items_for_download.pop(i)
+                    st.toast(f"Removed: {combo['description']}", icon="🗑️")
+                    st.rerun() 
+            st.markdown("---")
+        else:
+            st.info("No items selected for download yet.")
+
+        render_step_4_export()
+
+    @st.fragment
+    def render_step_4_export():
+        # --- Step 4: Generate Master Data File ---
+        st.header("Step 4: Generate master data file")
+
+        def prepare_master_data_for_download_final(export_format):
+            if not st.session_state.final_items_for_download: st.warning("No items selected."); return None
+            current_selected_currency_for_dl = st.session_state.selected_currency_session
+            if not current_selected_currency_for_dl: st.warning("Select currency first."); return None
+            try:
+                output_df, export_warnings = build_master_data_frame(catalog, st.session_state.final_items_for_download, current_selected_currency_for_dl)
+            except ValueError as e: st.error(str(e)); return None
+            for export_warning in export_warnings: st.warning(export_warning)
+            if output_df is None: st.info("No data to output."); return None
+            return write_master_data(output_df, export_format)
+
+        can_download_now = bool(st.session_state.final_items_for_download and st.session_state.selected_currency_session)
+        st.radio("File format:", options=list(EXPORT_FORMATS), format_func=lambda export_format: EXPORT_FORMATS[export_format]['label'], horizontal=True, key="export_format_choice",
+                 help="CSV has the same columns as the Excel file. Parquet and JSON Lines store prices as numbers and add a "
+                      "status column after each price column (e.g. `Wholesale price (DKK) status`: 'Price Not Found', empty when priced). "
+                      "All three are faster to generate and import.")
+        export_format = st.session_state.export_format_choice
+        if can_download_now:
+            # The file is only built on request and reused until currency, selection, format or catalog change
+            export_fingerprint = (st.session_state.selected_currency_session, export_format, catalog['signatures'], tuple((combo['item_no'], combo['article_no']) for combo in st.session_state.final_items_for_download))
+            file_bytes = None
+            if st.session_state.export_cache and st.session_state.export_cache['fingerprint'] == export_fingerprint:
+                file_bytes = st.session_state.export_cache['file_bytes']
+            elif st.button("Generate Master Data File", key="generate_master_data_button", help="Build the master data file for the current selections."):
+                file_bytes = prepare_master_data_for_download_final(export_format)
+                st.session_state.export_cache = {'fingerprint': export_fingerprint, 'file_bytes': file_bytes} if file_bytes else None
+            if file_bytes: 
+                st.download_button(label="Download Master Data File", data=file_bytes, file_name=get_export_file_name(st.session_state.selected_currency_session, export_format), mime=EXPORT_FORMATS[export_format]['mime'], key="final_download_button_v10", help="Click to download.")
+        else:
+            help_msg = "Select currency (Step 1) and add items (Step 2 & 3)."
+            if not st.session_state.selected_currency_session: help_msg = "Select currency first."
+            elif not st.session_state.final_items_for_download: help_msg = "Select items first."
+            st.button("Generate Master Data File", key="generate_disabled_button_v8", disabled=True, help=help_msg)
 
-    def prepare_excel_for_download_final():
-        if not st.session_state.final_items_for_download: st.warning("No items selected."); return None
-        current_selected_currency_for_dl = st.session_state.selected_currency_session
-        if not current_selected_currency_for_dl: st.warning("Select currency first."); return None
+    render_step_2_selection_matrix()
 
-        if current_selected_currency_for_dl in EXPECTED_GBP_IE_CURRENCIES:
-            ws_prices, rt_prices = st.session_state.wholesale_prices_gbp_ie_df, st.session_state.retail_prices_gbp_ie_df
-            if ws_prices is None or rt_prices is None: st.error(f"GBP/IE price matrix not loaded."); return None
-        elif current_selected_currency_for_dl in EXPECTED_EUROPE_CURRENCIES:
-            ws_prices, rt_prices = st.session_state.wholesale_prices_df, st.session_state.retail_prices_df
-            if ws_prices is None or rt_prices is None: st.error(f"Europe price matrix not loaded."); return None
-        else: st.error(f"Currency '{current_selected_currency_for_dl}' not configured."); return None
-        
-        output_data = []
-        ws_price_col_dyn = f"Wholesale price ({current_selected_currency_for_dl})"
-        rt_price_col_dyn = f"Retail price ({current_selected_currency_for_dl})"
-        
-        final_output_cols, seen_cols = [], set()
-        for col_temp in st.session_state.template_cols:
-            target_col = ws_price_col_dyn if col_temp.lower() == "wholesale price" else (rt_price_col_dyn if col_temp.lower() == "retail price" else col_temp)
-            if target_col not in seen_cols: final_output_cols.append(target_col); seen_cols.add(target_col)
-        if ws_price_col_dyn not in final_output_cols: final_output_cols.append(ws_price_col_dyn)
-        if rt_price_col_dyn not in final_output_cols: final_output_cols.append(rt_price_col_dyn)
-        
-        if st.session_state.raw_df is None: st.error("Raw data unavailable."); return None
-
-        for combo in st.session_state.final_items_for_download:
-            item_no, article_no = combo['item_no'], combo['article_no']
-            item_data_df = st.session_state.raw_df[st.session_state.raw_df['Item No'] == item_no]
-            if not item_data_df.empty:
-                item_series = item_data_df.iloc[0]
-                output_row_dict = {}
-                
-                for template_col_name in final_output_cols:
-                    if template_col_name == ws_price_col_dyn or template_col_name == rt_price_col_dyn:
-                        output_row_dict[template_col_name] = None 
-                        continue 
-                    
-                    value_to_assign = None
-                    if template_col_name.strip().lower() == "product":
-                        if "Item Name" in item_series.index:
-                            value_to_assign = item_series["Item Name"]
-                        else:
-                            st.warning("Kolonnen 'Item Name' blev ikke fundet i rådata. 'Product'-kolonnen i output kan være tom.")
-                            value_to_assign = item_series.get("Product Display Name", None) # Fallback to Product Display Name if Item Name is missing
-                    elif template_col_name in item_series.index:
-                        value_to_assign = item_series[template_col_name]
-                    
-                    output_row_dict[template_col_name] = value_to_assign
-                
-                if not ws_prices.empty:
-                    article_col_ws = ws_prices.columns[0]
-                    price_df = ws_prices[ws_prices[article_col_ws].astype(str) == str(article_no)]
-                    output_row_dict[ws_price_col_dyn] = price_df.iloc[0][current_selected_currency_for_dl] if not price_df.empty and current_selected_currency_for_dl in price_df.columns and pd.notna(price_df.iloc[0][current_selected_currency_for_dl]) else "Price Not Found"
-                else: output_row_dict[ws_price_col_dyn] = "Wholesale Matrix Empty"
-                
-                if not rt_prices.empty:
-                    article_col_rt = rt_prices.columns[0]
-                    price_df = rt_prices[rt_prices[article_col_rt].astype(str) == str(article_no)]
-                    output_row_dict[rt_price_col_dyn] = price_df.iloc[0][current_selected_currency_for_dl] if not price_df.empty and current_selected_currency_for_dl in price_df.columns and pd.notna(price_df.iloc[0][current_selected_currency_for_dl]) else "Price Not Found"
-                else: output_row_dict[rt_price_col_dyn] = "Retail Matrix Empty"
-                output_data.append(output_row_dict)
-            else: st.warning(f"Item No {item_no} not found. Skipping.")
-
-        if not output_data: st.info("No data to output."); return None
-        output_df = pd.DataFrame(output_data, columns=final_output_cols)
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer: output_df.to_excel(writer, index=False, sheet_name='Masterdata Output')
-        return buffer.getvalue()
-
-    can_download_now = bool(st.session_state.final_items_for_download and st.session_state.selected_currency_session)
-    if can_download_now:
-        file_bytes = prepare_excel_for_download_final()
-        if file_bytes: 
-            st.download_button(label="Generate and Download Master Data File", data=file_bytes, file_name=f"masterdata_output_{st.session_state.selected_currency_session.replace(' ', '_').replace('.', '')}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="final_download_button_v10", help="Click to download.")
-    else:
-        help_msg = "Select currency (Step 1) and add items (Step 2 & 3)."
-        if not st.session_state.selected_currency_session: help_msg = "Select currency first."
-        elif not st.session_state.final_items_for_download: help_msg = "Select items first."
-        st.button("Generate Master Data File", key="generate_disabled_button_v8", disabled=True, help=help_msg)
+    catalog_rows, catalog_megabytes = len(catalog['raw_df']), sum(catalog['memory_footprint'].values()) / 1e6
+    st.caption(f"Catalog: {catalog_rows} rows, {catalog_megabytes:.1f} MB in memory (shared by all sessions).")
 
 else: 
     st.error("Application cannot start. Critical data files missing or corrupt. Check paths and file integrity.")
@@ -664,6 +678,15 @@ st.markdown("""
     div[data-testid="stCaptionContainer"] img { max-height: 25px !important; width: 25px !important; object-fit: cover !important; margin-right:2px; }
     .swatch-placeholder { width:25px !important; height:25px !important; display: flex; align-items: center; justify-content: center; font-size: 0.6em; color: #ccc; border: 1px dashed #ddd; background-color: #f9f9f9; }
     .zoom-instruction { font-size: 0.6em; color: #555; text-align: left; padding-top: 10px; }
+
+    /* Swatch sprite header: one slot per matrix column, each showing its cell of the family sprite */
+    .swatch-sprite-row { display: flex; width: 100%; }
+    .swatch-sprite-slot { flex: 1 1 0; display: flex; justify-content: center; }
+    .swatch-sprite-cell { display: block; background-repeat: no-repeat; }
+    .swatch-zoom { display: none; position: fixed; inset: 0; z-index: 1000; background-color: rgba(0, 0, 0, 0.6); align-items: center; justify-content: center; }
+    .swatch-zoom:target { display: flex; }
+    .swatch-zoom-close { display: flex; flex-direction: column; align-items: center; gap: 8px; color: #fff !important; text-decoration: none !important; }
+    .swatch-zoom-cell { display: block; background-repeat: no-repeat; border: 4px solid #fff; }
     
     .select-all-label { 
         font-size: 0.75em; 
@@ -0,0 +1,247 @@
+"""Local thumbnail cache for the upholstery swatch images.
+
+get_swatch_thumbnail(url) returns a small PNG for a swatch URL. Each swatch is
+downloaded once, shrunk to THUMBNAIL_SIZE px and kept in an in-memory LRU plus a
+disk cache keyed by the URL hash (oldest files evicted past MAX_DISK_ENTRIES).
+Render code uses request_swatches(urls), which only reads the caches and leaves
+downloads to a background pool, so a page never waits on the network.
+build_swatch_sprite(urls) composes cached thumbnails of a matrix header, in
+column order, into one sprite image; get_swatch_sprite_url(urls) writes it under
+SWATCH_SPRITE_DIR, named by content hash, for Streamlit's static file serving
+(server.enableStaticServing), so pages reference it by URL.
+Without network access, images are taken from SWATCH_STANDIN_DIR, matched by the
+URL's file name or by "<url hash>.<ext>".
+
+Warm the disk cache ahead of a deploy with:
+    python swatch_cache.py
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SWATCH_CACHE_DIR = os.path.join(BASE_DIR, ".swatch-cache")
+SWATCH_STANDIN_DIR = os.path.join(BASE_DIR, "swatches")
+SWATCH_SPRITE_DIR = os.path.join(BASE_DIR, "static", "swatch-sprites")
+SWATCH_SPRITE_URL_PATH = "app/static/swatch-sprites"
+THUMBNAIL_SIZE = 60
+MAX_MEMORY_ENTRIES = 512
+MAX_DISK_ENTRIES = 5000
+DOWNLOAD_TIMEOUT_SECONDS = 5
+FAILED_RETRY_SECONDS = 300
+PREFETCH_WORKERS = 8
+MAX_SPRITES = 64
+SPRITE_BACKGROUND = (249, 249, 249)
+
+_memory_cache = OrderedDict()
+_sprite_cache = OrderedDict()
+_failed_urls = {}
+_pending_urls = set()
+_fetch_executor = None
+_lock = threading.Lock()
+
+
+def swatch_cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def make_thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert("RGBA") if image.mode in ("P", "LA", "RGBA") else image.convert("RGB")
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _read_standin(url, cache_key, standin_dir):
+    file_name = os.path.basename(urllib.parse.urlparse(url).path)
+    candidates = [file_name] if file_name else []
+    if os.path.isdir(standin_dir):
+        candidates += [name for name in os.listdir(standin_dir) if os.path.splitext(name)[0] == cache_key]
+    for name in candidates:
+        path = os.path.join(standin_dir, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                return f.read()
+    return None
+
+
+def _download(url):
+    request = urllib.request.Request(url, headers={"User-Agent": "muuto-m2o-app swatch cache"})
+    with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+        return response.read()
+
+
+def _write_disk_entry(path, thumbnail, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(thumbnail)
+    os.replace(tmp_path, path)
+    cached_files = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(".png")]
+    if len(cached_files) > MAX_DISK_ENTRIES:
+        cached_files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in cached_files[:len(cached_files) - MAX_DISK_ENTRIES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _remember(url, thumbnail):
+    with _lock:
+        _memory_cache[url] = thumbnail
+        _memory_cache.move_to_end(url)
+        while len(_memory_cache) > MAX_MEMORY_ENTRIES:
+            _memory_cache.popitem(last=False)
+
+
+def _valid_urls(urls):
+    return [url for url in dict.fromkeys(urls) if isinstance(url, str) and url.strip()]
+
+
+def get_cached_swatch_thumbnail(url, cache_dir=SWATCH_CACHE_DIR):
+    """Thumbnail from the memory or disk cache, or None. Never downloads."""
+    if not isinstance(url, str) or not url.strip():
+        return None
+    with _lock:
+        if url in _memory_cache:
+            _memory_cache.move_to_end(url)
+            return _memory_cache[url]
+    disk_path = os.path.join(cache_dir, f"{swatch_cache_key(url)}.png")
+    try:
+        with open(disk_path, "rb") as f:
+            thumbnail = f.read()
+        os.utime(disk_path)  # Recently used files survive eviction
+    except OSError:
+        return None
+    _remember(url, thumbnail)
+    return thumbnail
+
+
+def get_swatch_thumbnail(url, cache_dir=SWATCH_CACHE_DIR, standin_dir=SWATCH_STANDIN_DIR):
+    """PNG thumbnail bytes for a swatch URL, or None if it cannot be fetched. Blocks while downloading."""
+    thumbnail = get_cached_swatch_thumbnail(url, cache_dir)
+    if thumbnail is not None or not isinstance(url, str) or not url.strip():
+        return thumbnail
+    with _lock:
+        if time.monotonic() - _failed_urls.get(url, float("-inf")) < FAILED_RETRY_SECONDS:
+            return None
+
+    cache_key = swatch_cache_key(url)
+    try:
+        image_bytes = _read_standin(url, cache_key, standin_dir) or _download(url)
+        thumbnail = make_thumbnail(image_bytes)
+    except Exception:
+        with _lock:
+            _failed_urls[url] = time.monotonic()
+        return None
+    try:
+        _write_disk_entry(os.path.join(cache_dir, f"{cache_key}.png"), thumbnail, cache_dir)
+    except OSError:
+        pass  # Read-only deploy: keep the thumbnail in memory only.
+
+    _remember(url, thumbnail)
+    return thumbnail
+
+
+def prefetch_swatches(urls, workers=PREFETCH_WORKERS):
+    """Fetches uncached swatches in parallel and waits; returns {url: thumbnail or None}."""
+    unique_urls = _valid_urls(urls)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(unique_urls, executor.map(get_swatch_thumbnail, unique_urls)))
+
+
+def _fetch_in_background(url):
+    try:
+        get_swatch_thumbnail(url)
+    finally:
+        with _lock:
+            _pending_urls.discard(url)
+
+
+def request_swatches(urls):
+    """Non-blocking: {url: cached thumbnail or None}.
+
+    Uncached URLs (outside their failure cool-down) are queued on a shared background
+    pool; their thumbnails show up in the cache for a later call.
+    """
+    global _fetch_executor
+    thumbnails = {url: get_cached_swatch_thumbnail(url) for url in _valid_urls(urls)}
+    missing_urls = [url for url, thumbnail in thumbnails.items() if thumbnail is None]
+    if not missing_urls:
+        return thumbnails
+    now = time.monotonic()
+    with _lock:
+        urls_to_fetch = [url for url in missing_urls
+                         if url not in _pending_urls and now - _failed_urls.get(url, float("-inf")) >= FAILED_RETRY_SECONDS]
+        _pending_urls.update(urls_to_fetch)
+        if urls_to_fetch and _fetch_executor is None:
+            _fetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="swatch-fetch")
+    for url in urls_to_fetch:
+        _fetch_executor.submit(_fetch_in_background, url)
+    return thumbnails
+
+
+def build_swatch_sprite(urls, cell_size=THUMBNAIL_SIZE):
+    """PNG with one cell_size square per URL, left to right, or None if a swatch is not cached yet.
+
+    Only cached thumbnails are used (no downloads). Entries without a URL become
+    blank cells. Complete sprites are memoized (LRU).
+    """
+    sprite_key = (tuple(url if isinstance(url, str) else None for url in urls), cell_size)
+    with _lock:
+        if sprite_key in _sprite_cache:
+            _sprite_cache.move_to_end(sprite_key)
+            return _sprite_cache[sprite_key]
+    sprite = Image.new("RGB", (cell_size * len(sprite_key[0]), cell_size), SPRITE_BACKGROUND)
+    for pos, url in enumerate(sprite_key[0]):
+        if not url or not url.strip():
+            continue
+        thumbnail = get_cached_swatch_thumbnail(url)
+        if thumbnail is None:
+            return None
+        with Image.open(io.BytesIO(thumbnail)) as image:
+            image = image.convert("RGBA")
+            image.thumbnail((cell_size, cell_size))
+            sprite.paste(image, (pos * cell_size + (cell_size - image.width) // 2, (cell_size - image.height) // 2), image)
+    buffer = io.BytesIO()
+    sprite.save(buffer, format="PNG", optimize=True)
+    with _lock:
+        _sprite_cache[sprite_key] = buffer.getvalue()
+        while len(_sprite_cache) > MAX_SPRITES:
+            _sprite_cache.popitem(last=False)
+    return buffer.getvalue()
+
+
+def get_swatch_sprite_url(urls, cell_size=THUMBNAIL_SIZE, sprite_dir=SWATCH_SPRITE_DIR):
+    """Static URL of the sprite for urls, or None if a swatch is not cached yet or the file cannot be written."""
+    sprite = build_swatch_sprite(urls, cell_size)
+    if sprite is None:
+        return None
+    file_name = f"{hashlib.sha256(sprite).hexdigest()[:32]}.png"
+    sprite_path = os.path.join(sprite_dir, file_name)
+    if not os.path.exists(sprite_path):
+        try:
+            _write_disk_entry(sprite_path, sprite, sprite_dir)
+        except OSError:
+            return None  # Read-only deploy: callers fall back to per-column images.
+    return f"{SWATCH_SPRITE_URL_PATH}/{file_name}"
+
+
+if __name__ == "__main__":
+    from catalog_snapshot import read_excel_sheet
+    from master_data import RAW_DATA_APP_SHEET, RAW_DATA_XLSX_PATH
+
+    swatch_urls = read_excel_sheet(RAW_DATA_XLSX_PATH, RAW_DATA_APP_SHEET)["Image URL swatch"].dropna().unique()
+    thumbnails = prefetch_swatches(swatch_urls)
+    print(f"Cached {sum(thumbnail is not None for thumbnail in thumbnails.values())} of {len(thumbnails)} swatches in {SWATCH_CACHE_DIR}")
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from master_data import MARKET_RULE_EUROPE, find_combos
+
+
+def make_catalog():
+    combo_df = pd.DataFrame({
+        'Product Family': ['Outline Sofa', 'Outline Sofa', 'Outline Sofa'],
+        'Product Display Name': ['Sofa - 2-Seater', 'Chaise Longue', 'Sofa - 3-Seater'],
+        'Upholstery Type': ['Fiord', 'Fiord', 'Fiord'],
+        'Upholstery Color': ['151', '171', '218'],
+        'Product Type': ['Sofa', 'Chaise', 'Sofa'],
+        'Product Model': ['2-Seater', 'Chaise', '3-Seater'],
+        'Sofa Direction': [None, 'Left', None],
+    })
+    return {'combo_frames': {MARKET_RULE_EUROPE: combo_df}}
+
+
+@pytest.mark.parametrize("filter_expr, expected", [
+    ("`Product Type` == 'Sofa'", [0, 2]),
+    ("`Product Type` == 'Sofa' and `Upholstery Color` != '151'", [2]),
+    ("`Upholstery Color` in ['151', '171']", [0, 1]),
+    ("not `Product Type` == 'Sofa' or `Product Model` == '3-Seater'", [1, 2]),
+    ("`Sofa Direction` == 'Left'", [1]),
+])
+def test_find_combos_filter_expression_matches_columns(filter_expr, expected):
+    assert find_combos(make_catalog(), MARKET_RULE_EUROPE, filter_expr=filter_expr) == expected
+
+
+@pytest.mark.parametrize("filter_expr", [
+    "@catalog.clear() == 1",
+    '`Product Type`.__class__.__init__.__globals__["sys"].modules["os"].system("touch {marker}") == 0',
+    "`Product Type`.str.len() > 3",
+    "`Product Type`[0] == 'S'",
+    "__import__('os').system('touch {marker}') == 0",
+    "`Item No` == 1",
+    "catalog == 1",
+])
+def test_find_combos_filter_expression_rejects_code(filter_expr, tmp_path):
+    catalog = make_catalog()
+    marker = tmp_path / "executed"
+    with pytest.raises(ValueError):
+        find_combos(catalog, MARKET_RULE_EUROPE, filter_expr=filter_expr.format(marker=marker))
+    assert not marker.exists()
+    assert MARKET_RULE_EUROPE in catalog['combo_frames']